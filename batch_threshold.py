@@ -0,0 +1,207 @@
+import argparse
+import csv
+import glob
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cv2
+
+from hsv_mask import CompiledMask, apply_mask, load_mask
+from mask_library import DEFAULT_LIBRARY, MaskLibrary
+
+# Deliberately free of tkinter/PIL imports so it can run on display-less servers
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".webp"}
+
+_mask = None
+_output_dir = None
+
+
+def iter_image_paths(inputs):
+    # Lazily yields (path, relative path) pairs so huge directories are never listed into memory
+    # at once. The relative path is taken from the input directory or the fixed part of the glob
+    # pattern, and is mirrored under the output directory. Images reached through several inputs
+    # (a directory plus a glob over it) are yielded once.
+    seen = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            root, paths = item, _scan_directory(item)
+        else:
+            root = _glob_root(item)
+            paths = (path for path in glob.iglob(item, recursive=True) if os.path.isfile(path))
+        for path in paths:
+            real_path = os.path.realpath(path)
+            if real_path not in seen:
+                seen.add(real_path)
+                yield path, os.path.relpath(path, root)
+
+
+def _scan_directory(directory):
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and os.path.splitext(entry.name)[1].lower() in IMAGE_EXTENSIONS:
+                yield entry.path
+
+
+def _glob_root(pattern):
+    # Directory part of a glob pattern before its first wildcard
+    parts = os.path.normpath(pattern).split(os.sep)
+    for i, part in enumerate(parts):
+        if glob.has_magic(part):
+            break
+    else:
+        i = len(parts) - 1  # a plain file path
+    return os.sep.join(parts[:i]) or os.curdir
+
+
+def _init_worker(mask, output_dir):
+    global _mask, _output_dir
+    _mask = mask
+    _output_dir = output_dir
+    # One OpenCV thread per process, the pool already provides the parallelism
+    cv2.setNumThreads(1)
+
+
+def threshold_image(path, relative):
+    started = time.perf_counter()
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"cannot decode {path}")
+    mask = apply_mask(_mask, image)
+
+    height, width = mask.shape[:2]
+    selected = cv2.countNonZero(mask)
+    output_path = ""
+    if _output_dir is not None:
+        output_path = os.path.join(_output_dir, os.path.splitext(relative)[0] + "_mask.png")
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        cv2.imwrite(output_path, mask)
+
+    return {
+        "path": path,
+        "width": width,
+        "height": height,
+        "selected": selected,
+        "coverage": selected / (width * height),
+        "output": output_path,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def run_batch(items, mask, output_dir=None, workers=None, max_pending=None):
+    # Yields (path, result, error) for (path, relative path) items as images finish; at most
+    # max_pending images are in flight. An image whose output would overwrite the output of an
+    # earlier one (same relative path under two inputs) fails instead.
+    items = _unique_outputs(items, output_dir)
+    if workers == 0:
+        _init_worker(mask, output_dir)
+        for path, relative in items:
+            if isinstance(relative, Exception):
+                yield path, None, relative
+                continue
+            try:
+                yield path, threshold_image(path, relative), None
+            except Exception as e:
+                yield path, None, e
+        return
+
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 4
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(mask, output_dir)) as pool:
+        pending = {}
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_pending:
+                item = next(items, None)
+                if item is None:
+                    exhausted = True
+                    break
+                path, relative = item
+                if isinstance(relative, Exception):
+                    yield path, None, relative
+                    continue
+                pending[pool.submit(threshold_image, path, relative)] = path
+            if not pending:
+                continue
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                error = future.exception()
+                yield path, None if error else future.result(), error
+
+
+def _unique_outputs(items, output_dir):
+    # Replaces the relative path of an item whose mask file is already taken with an error
+    outputs = {}
+    for path, relative in items:
+        if output_dir is not None:
+            output = os.path.normcase(os.path.splitext(relative)[0])
+            if output in outputs:
+                relative = ValueError(f"output {os.path.splitext(relative)[0]}_mask.png already written for {outputs[output]}")
+            else:
+                outputs[output] = path
+        yield path, relative
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply a saved HSV mask to many images without the GUI.")
+    parser.add_argument("inputs", nargs="+", metavar="path",
+                        help="mask file saved by the calibration app (omitted with --profile), then image directories or glob patterns")
+    parser.add_argument("--profile", help="use the latest version of this mask library profile instead of a mask file")
+    parser.add_argument("--library", default=DEFAULT_LIBRARY, help=f"mask library for --profile (default: {DEFAULT_LIBRARY})")
+    parser.add_argument("-o", "--output", help="directory for binary masks; only statistics are reported when omitted")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes (default: CPU count, 0 = in-process)")
+    parser.add_argument("--max-pending", type=int, default=None, help="images in flight at once (default: 4 per worker)")
+    args = parser.parse_intermixed_args(argv)
+
+    # Same compiled lookup-table form as the GUI preview, including wrapped hue ranges
+    inputs = args.inputs
+    if args.profile:
+        try:
+            with MaskLibrary(args.library) as library:
+                mask = CompiledMask.from_pairs(*library.load(args.profile))
+        except KeyError as e:
+            parser.error(e.args[0])
+        except (sqlite3.Error, ValueError) as e:
+            parser.error(f"cannot read mask library {args.library}: {e}")
+    elif len(inputs) < 2:
+        parser.error("a mask file and at least one input are required")
+    else:
+        try:
+            mask = load_mask(inputs[0])
+        except (OSError, ValueError) as e:
+            parser.error(f"cannot read mask file {inputs[0]}: {e}")
+        inputs = inputs[1:]
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["path", "width", "height", "selected", "coverage", "output"])
+
+    started = time.perf_counter()
+    processed = failed = pixels = 0
+    for path, result, error in run_batch(iter_image_paths(inputs), mask, args.output, args.workers, args.max_pending):
+        if error is not None:
+            failed += 1
+            print(f"error: {path}: {error}", file=sys.stderr)
+            continue
+        processed += 1
+        pixels += result["width"] * result["height"]
+        writer.writerow([result["path"], result["width"], result["height"], result["selected"],
+                         f"{result['coverage']:.6f}", result["output"]])
+        sys.stdout.flush()
+
+    elapsed = time.perf_counter() - started
+    rate = processed / elapsed if elapsed > 0 else 0.0
+    megapixels = pixels / 1e6 / elapsed if elapsed > 0 else 0.0
+    print(f"{processed} images ({failed} failed) in {elapsed:.2f} s: {rate:.1f} images/s, {megapixels:.1f} MP/s",
+          file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from hsv_index import HsvHistogramIndex
+from hsv_mask import CompiledMask
+from mask_history import PackedMaskCache
+from tiled_image import LRUCache, Viewport, build_pyramids, render_viewport
+
+# Synthetic image sizes (width, height) from VGA up to 50 MP
+SIZES = {
+    "vga": (640, 480),
+    "hd": (1280, 720),
+    "fhd": (1920, 1080),
+    "12mp": (4000, 3000),
+    "24mp": (6000, 4000),
+    "50mp": (8192, 6144),
+}
+DISPLAY_SIZE = (1600, 900)
+MASK_PAIRS = [((0, 200, 200), (10, 60, 60))]
+MULTI_MASK_PAIRS = [((0, 200, 200), (10, 60, 60)), ((60, 150, 150), (15, 80, 80)), ((120, 100, 200), (20, 90, 50))]
+
+
+def synthetic_image(width, height, seed=0):
+    # Smooth random color fields with fine noise, the same pixels for every run
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, (max(2, height // 64), max(2, width // 64), 3), dtype=np.uint8)
+    image = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    noise = rng.integers(-8, 9, (min(height, 256), min(width, 256), 3), dtype=np.int16)
+    tiled = np.tile(noise, (-(-height // noise.shape[0]), -(-width // noise.shape[1]), 1))[:height, :width]
+    return np.clip(image + tiled, 0, 255).astype(np.uint8)
+
+
+def time_stage(fn, repeat, setup=None):
+    # Median and min wall time in ms over repeat runs, after one warm-up run
+    times = []
+    for i in range(repeat + 1):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        if i:
+            times.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": statistics.median(times), "min_ms": min(times), "runs": repeat}
+
+
+def fit_size(width, height, target_width, target_height):
+    scale = min(target_width / width, target_height / height, 1.0)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def pipeline_stages(image, repeat):
+    # Stages that need no display: conversion, thresholding and display preparation
+    height, width = image.shape[:2]
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    image_pyramid, hsv_pyramid = build_pyramids(image)
+    single = CompiledMask.from_pairs(MASK_PAIRS, wrap_hue=True)
+    multi = CompiledMask.from_pairs(MULTI_MASK_PAIRS, wrap_hue=True)
+    display_width, display_height = fit_size(width, height, *DISPLAY_SIZE)
+    preview_width, preview_height = fit_size(width, height, display_width // 9, display_height // 9)
+    preview_level = next(level for level in reversed(hsv_pyramid) if level.shape[1] >= preview_width)
+    viewport = Viewport()
+    viewport.update(width, height, *DISPLAY_SIZE)
+    display = cv2.resize(image, (display_width, display_height), interpolation=cv2.INTER_AREA)
+    mask = single.apply(hsv)
+    cache = PackedMaskCache(1 << 30)
+    index = HsvHistogramIndex(hsv)
+
+    return {
+        "hsv_convert": time_stage(lambda: cv2.cvtColor(image, cv2.COLOR_BGR2HSV), repeat),
+        "build_pyramids": time_stage(lambda: build_pyramids(image), repeat),
+        "histogram_index": time_stage(lambda: HsvHistogramIndex(hsv), repeat),
+        "in_range": time_stage(lambda: cv2.inRange(hsv, *single.boxes()[0]), repeat),
+        "compiled_mask_3_ranges": time_stage(lambda: multi.apply(hsv), repeat),
+        "coverage_query": time_stage(lambda: index.coverage_union(multi.boxes()), repeat),
+        "preview_mask": time_stage(lambda: cv2.resize(single.apply(preview_level), (preview_width, preview_height),
+                                                      interpolation=cv2.INTER_AREA), repeat),
+        "resize_to_display": time_stage(lambda: cv2.resize(image, (display_width, display_height),
+                                                           interpolation=cv2.INTER_AREA), repeat),
+        "viewport_render_cold": time_stage(lambda: render_viewport(image_pyramid, viewport.state(),
+                                                                   lambda tile: cv2.cvtColor(tile, cv2.COLOR_BGR2RGB),
+                                                                   LRUCache(1 << 28), 0), repeat),
+        "bgr_to_rgb_display": time_stage(lambda: cv2.cvtColor(display, cv2.COLOR_BGR2RGB), repeat),
+        "mask_cache_put_get": time_stage(lambda: (cache.put("mask", mask), cache.get("mask")), repeat),
+    }
+
+
+def gui_stages(image, repeat, idle_timeout=2.0):
+    # Stages that need Tk: PhotoImage creation and the app's slider-to-pixels latency.
+    # Returns None without a display; run under xvfb-run on headless machines.
+    import tkinter as tk
+    from PIL import Image, ImageTk
+
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        return None
+    try:
+        from calibration import ColorCalibrationApp
+
+        height, width = image.shape[:2]
+        display_width, display_height = fit_size(width, height, *DISPLAY_SIZE)
+        rgb = cv2.cvtColor(cv2.resize(image, (display_width, display_height), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2RGB)
+        photo = ImageTk.PhotoImage(image=Image.fromarray(rgb))
+        results = {
+            "photoimage_create": time_stage(lambda: ImageTk.PhotoImage(image=Image.fromarray(rgb)), repeat),
+            "photoimage_paste": time_stage(lambda: photo.paste(Image.fromarray(rgb)), repeat),
+        }
+
+        root.geometry(f"{DISPLAY_SIZE[0]}x{DISPLAY_SIZE[1]}")
+        app = ColorCalibrationApp(root)
+        root.update()
+        results["load_image"] = time_stage(lambda: (app.set_image(image), root.update()), max(1, min(repeat, 3)))
+
+        def cold_display():
+            app.image_generation += 1
+            app.original_tile_cache.clear()
+        results["display_original_image"] = time_stage(app.display_original_image, repeat, setup=cold_display)
+
+        # Slider-to-pixels: from a tolerance change to the fast and the full-quality preview on screen
+        delivered = []
+        show_binary_mask = app.mask_scheduler.deliver
+
+        def record(frame, quality):
+            show_binary_mask(frame, quality)
+            root.update_idletasks()
+            delivered.append((time.perf_counter(), quality))
+        app.mask_scheduler.deliver = record
+        app.hsv_value.set("H: 0, S: 200, V: 200")
+        fast, full = [], []
+        for i in range(repeat + 1):
+            delivered.clear()
+            app.h_tolerance.set(10 + i % 40)
+            started = time.perf_counter()
+            app.update_mask_from_sliders()
+            while time.perf_counter() - started < idle_timeout:
+                root.update()
+                if delivered and (delivered[-1][1] == "full" or
+                                  time.perf_counter() - delivered[-1][0] > app.mask_scheduler.idle_delay + 0.2):
+                    break
+                time.sleep(0.001)
+            if i and delivered:
+                fast.append((delivered[0][0] - started) * 1000)
+                full.append((delivered[-1][0] - started) * 1000)
+        if fast:
+            results["slider_to_fast_preview"] = {"median_ms": statistics.median(fast), "min_ms": min(fast), "runs": len(fast)}
+            results["slider_to_full_preview"] = {"median_ms": statistics.median(full), "min_ms": min(full), "runs": len(full)}
+        app.mask_scheduler.close()
+        return results
+    finally:
+        root.destroy()
+
+
+def compare(results, baseline, tolerance, min_delta=0.5):
+    # (size, stage, baseline ms, current ms) for every stage whose median got slower by more than
+    # tolerance; sub-millisecond jitter (below min_delta ms) is never reported
+    regressions = []
+    for size, stages in results["results"].items():
+        for stage, current in stages.items():
+            previous = baseline.get("results", {}).get(size, {}).get(stage)
+            if previous and current["median_ms"] > max(previous["median_ms"] * (1 + tolerance),
+                                                       previous["median_ms"] + min_delta):
+                regressions.append((size, stage, previous["median_ms"], current["median_ms"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the thresholding and display pipeline on synthetic images.")
+    parser.add_argument("--sizes", default=",".join(SIZES), help=f"comma separated sizes out of {', '.join(SIZES)}")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="timed runs per stage (after one warm-up run)")
+    parser.add_argument("-o", "--output", help="write results as JSON to this file")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against the baseline (default: 0.2 = 20%%)")
+    parser.add_argument("--min-delta", type=float, default=0.5, help="ignore slowdowns smaller than this many ms (default: 0.5)")
+    parser.add_argument("--no-gui", action="store_true", help="skip the stages that need a display")
+    args = parser.parse_args(argv)
+
+    sizes = [size.strip() for size in args.sizes.split(",") if size.strip()]
+    unknown = [size for size in sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(unknown)}")
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+            "opencv_threads": cv2.getNumThreads(),
+            "repeat": args.repeat,
+        },
+        "results": {},
+    }
+    for size in sizes:
+        width, height = SIZES[size]
+        image = synthetic_image(width, height)
+        stages = pipeline_stages(image, args.repeat)
+        if not args.no_gui:
+            gui = gui_stages(image, args.repeat)
+            if gui is None:
+                print("no display, skipping GUI stages (use xvfb-run or --no-gui)", file=sys.stderr)
+                args.no_gui = True
+            else:
+                stages.update(gui)
+        results["results"][size] = stages
+        for stage, timing in stages.items():
+            print(f"{size:>5} {stage:<24} {timing['median_ms']:10.2f} ms (min {timing['min_ms']:.2f})", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, args.min_delta)
+        for size, stage, previous, current in regressions:
+            print(f"REGRESSION {size} {stage}: {previous:.2f} ms -> {current:.2f} ms ({current / previous - 1:+.0%})",
+                  file=sys.stderr)
+        if regressions:
+            return 1
+        print(f"no regressions beyond {args.tolerance:.0%} against {args.baseline}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
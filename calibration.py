@@ -1,10 +1,185 @@
+import argparse
 import cv2
 import numpy as np
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import colorchooser, filedialog, messagebox, simpledialog, ttk
 import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
 from PIL import Image, ImageTk
 
+from calibration_set import THUMBNAIL_SIZE, CalibrationSet, aggregate_coverage, find_outliers
+from frame_share import DEFAULT_NAME as SHARED_FRAMES_NAME, SharedFrameSource
+from hsv_index import FULL_BINS, HsvHistogramIndex, suggest_bounds
+from image_loader import AsyncImageLoad
+from hsv_mask import CompiledMask, read_mask_file, write_mask_file
+from mask_library import DEFAULT_LIBRARY, MaskLibrary
+from mask_history import PackedMaskCache, ParamHistory
+from overlay import OverlayCompositor
+from perf_stats import PerfRecorder
+from postprocess import MedianBlur, MinAreaFilter, Morphology, PostProcessPipeline
+from tiled_image import LRUCache, Viewport, build_pyramids, render_viewport, viewport_level, visible_rect
+from video_source import FpsMeter, VideoFrameSource
+
+
+def prepare_video_frame(frame):
+    # Runs on the decode thread. An exact index per frame would cost more than the decode,
+    # so video frames get a binned index built from a preview level instead.
+    image_pyramid, hsv_pyramid = build_pyramids(frame)
+    level = next((l for l in hsv_pyramid if l.shape[0] * l.shape[1] <= 1 << 19), hsv_pyramid[-1])
+    return image_pyramid, hsv_pyramid, HsvHistogramIndex(level, bins=(45, 64, 64))
+
+
+def prepare_image(image):
+    # Runs on the image loader thread: pyramids and an exact coverage index
+    image_pyramid, hsv_pyramid = build_pyramids(image)
+    return image_pyramid, hsv_pyramid, HsvHistogramIndex(hsv_pyramid[0])
+
+
+class MaskRenderScheduler:
+    # Renders masks on a worker thread. Only the newest submitted parameters are rendered:
+    # a fast low-resolution pass first, then a full-quality pass once input has been idle
+    # for idle_delay ms. Finished frames are handed back to Tk on the main thread via after().
+    def __init__(self, master, render, deliver, idle_delay=150, poll_interval=15, perf=None, name="render"):
+        self.master = master
+        self.render = render  # render(params, quality) -> frame or None, runs on the worker
+        self.deliver = deliver  # deliver(frame, quality), runs on the Tk thread
+        self.idle_delay = idle_delay / 1000
+        self.poll_interval = poll_interval
+        self.coalesced = 0
+        self.perf = perf or PerfRecorder()
+        self.name = name
+        self._condition = threading.Condition()
+        self._pending = None
+        self._generation = 0
+        self._submitted = 0.0
+        self._result = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self._poll_id = master.after(poll_interval, self._poll)
+
+    def submit(self, params):
+        with self._condition:
+            if self._pending is not None:
+                self.coalesced += 1
+                self.perf.count(f"{self.name}.coalesced")
+            self._pending = params
+            self._generation += 1
+            self._submitted = time.perf_counter()
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        try:
+            self.master.after_cancel(self._poll_id)
+        except tk.TclError:
+            pass
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._closed)
+                if self._closed:
+                    return
+                params, generation, submitted = self._pending, self._generation, self._submitted
+                self._pending = None
+            self._render_and_publish(params, "fast", generation, submitted)
+
+            # Refine only if no newer request arrives while input is idle
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._closed, timeout=self.idle_delay)
+                if self._pending is not None or self._closed:
+                    continue
+            self._render_and_publish(params, "full", generation, submitted)
+
+    def _render_and_publish(self, params, quality, generation, submitted):
+        try:
+            with self.perf.stage(f"{self.name}.render.{quality}"):
+                frame = self.render(params, quality)
+        except Exception:
+            # Keep the worker alive, but do not hide the error
+            self.perf.count(f"{self.name}.errors")
+            traceback.print_exc()
+            return
+        if frame is None:
+            return
+        with self._condition:
+            # A newer request has been submitted meanwhile, this frame is already stale
+            if generation != self._generation:
+                self.perf.count(f"{self.name}.stale")
+                return
+            if self._result is not None:
+                self.perf.count(f"{self.name}.dropped")  # replaced before Tk picked it up
+            self._result = (frame, quality, submitted)
+
+    def _poll(self):
+        with self._condition:
+            result, self._result = self._result, None
+        try:
+            if result is not None:
+                frame, quality, submitted = result
+                with self.perf.stage(f"{self.name}.deliver"):
+                    self.deliver(frame, quality)
+                # Input-to-pixels latency: from submit() until the frame has been handed to Tk
+                self.perf.record(f"{self.name}.latency.{quality}", submitted, time.perf_counter() - submitted)
+        finally:
+            # A failing deliver must not stop this view from ever updating again
+            if not self._closed:
+                self._poll_id = self.master.after(self.poll_interval, self._poll)
+
+
+class CanvasImageView:
+    # Keeps a single canvas item and PhotoImage per view. Pixels of the same size are pasted
+    # into the existing PhotoImage, and a redraw with an unchanged key is skipped entirely.
+    def __init__(self, canvas, anchor=tk.NW):
+        self.canvas = canvas
+        self.anchor = anchor
+        self.item = None
+        self.photo = None
+        self.photo_mode = None
+        self.position = None
+        self.key = None
+
+    def is_current(self, key):
+        return key is not None and key == self.key
+
+    def show(self, array, x=0, y=0, key=None):
+        image = Image.fromarray(array)
+        if self.photo is not None and self.photo.width() == image.width and self.photo.height() == image.height \
+                and self.photo_mode == image.mode:
+            self.photo.paste(image)
+        else:
+            self.photo = ImageTk.PhotoImage(image=image)
+            self.photo_mode = image.mode
+            if self.item is not None:
+                self.canvas.itemconfigure(self.item, image=self.photo)
+
+        if self.item is None:
+            self.item = self.canvas.create_image(x, y, anchor=self.anchor, image=self.photo)
+        elif self.position != (x, y):
+            self.canvas.coords(self.item, x, y)
+        self.position = (x, y)
+        self.key = key
+
+    def clear(self):
+        if self.item is not None:
+            self.canvas.delete(self.item)
+        self.item = None
+        self.photo = None
+        self.photo_mode = None
+        self.position = None
+        self.key = None
+
+
+OUTLIER_COLORS = {"under": "#3060ff", "over": "#ff3030"}
+
+
 class ColorCalibrationApp:
     def __init__(self, master):
         try:
@@ -16,11 +191,26 @@ class ColorCalibrationApp:
         master.title("Color Mask Calibration App")
 
         self.original_image = None
+        self.image_generation = 0
+        self.hsv_image = None
+        self.image_pyramid = []
+        self.hsv_pyramid = []
+        self.hsv_index = None
         self.hsv_value = tk.StringVar(master, value="H: -, S: -, V: -")
         self.h_tolerance = tk.IntVar(master, value=50)
         self.s_tolerance = tk.IntVar(master, value=40)
         self.v_tolerance = tk.IntVar(master, value=30)
         self.mask_values = None
+        self.extra_ranges = []  # (center, tolerance) pairs OR-ed with the slider range
+        # Hue ranges wrap through 0/180; masks loaded from files without the wrap header clamp
+        self.wrap_hue = tk.BooleanVar(master, value=True)
+        self._resize_job = None
+        # Hot-path timings, shown in the performance overlay and exportable as a trace
+        self.perf = PerfRecorder()
+        self.mask_scheduler = MaskRenderScheduler(master, self.render_mask_preview, self.show_binary_mask, perf=self.perf,
+                                                  name="preview")
+        self._calibration_set_update = None  # set while a calibration set window is open
+        self._calibration_set_window = None
 
         # Configure grid layout
         master.grid_columnconfigure(0, weight=9)
@@ -34,9 +224,28 @@ class ColorCalibrationApp:
 
         self.original_label = tk.Label(self.original_image_frame, text="Original Picture")
         self.original_label.pack()
+        # Shown while an image is loading in the background
+        self.image_load = None
+        self._image_load_job = None
+        self._preview_load = None
+        self.load_status = tk.StringVar(master, value="")
+        self.load_frame = tk.Frame(self.original_image_frame)
+        self.load_progress = ttk.Progressbar(self.load_frame, maximum=100, length=200)
+        self.load_progress.pack(side=tk.LEFT, padx=5)
+        tk.Label(self.load_frame, textvariable=self.load_status).pack(side=tk.LEFT)
         self.original_canvas = tk.Canvas(self.original_image_frame)
         self.original_canvas.pack(expand=True, fill=tk.BOTH)
-        self.original_canvas.bind("<Button-1>", self.pick_color)
+        self.original_canvas.bind("<Button-1>", self.on_canvas_press)
+        self.original_canvas.bind("<B1-Motion>", self.on_canvas_drag)
+        self.original_canvas.bind("<ButtonRelease-1>", self.on_canvas_release)
+        # Zoom with the wheel, pan by dragging with the middle or right button
+        self.original_canvas.bind("<MouseWheel>", self.on_canvas_wheel)
+        self.original_canvas.bind("<Button-4>", self.on_canvas_wheel)
+        self.original_canvas.bind("<Button-5>", self.on_canvas_wheel)
+        for button in (2, 3):
+            self.original_canvas.bind(f"<ButtonPress-{button}>", self.on_pan_start)
+            self.original_canvas.bind(f"<B{button}-Motion>", self.on_pan_drag)
+        self.original_canvas.bind("<Double-Button-2>", lambda e: self.fit_original_to_window())
 
         # Binary Image
         self.binary_image_frame = tk.Frame(master)
@@ -48,6 +257,18 @@ class ColorCalibrationApp:
         self.binary_canvas.pack(expand=True, fill=tk.BOTH)
         self.binary_canvas.bind("<Button-1>", self.open_binary_image_in_viewer)
 
+        self.original_view = CanvasImageView(self.original_canvas)
+        self.binary_view = CanvasImageView(self.binary_canvas)
+        self._binary_request = None
+
+        # Only tiles in view are rendered; rendered tiles are cached per zoom level
+        self.original_viewport = Viewport()
+        self.original_tile_cache = LRUCache(128 << 20)
+        # Computed masks (previews and viewer tiles) keyed by image, ranges and pyramid level
+        self.mask_cache = PackedMaskCache(64 << 20)
+        self._original_buffer = None
+        self._pan_anchor = None
+
         # Right side controls (sliders)
         self.right_frame = tk.Frame(master)
         self.right_frame.grid(row=1, column=1, sticky="nse")
@@ -85,6 +306,8 @@ class ColorCalibrationApp:
         self.h_entry.pack(side=tk.LEFT, padx=5)
         self.h_entry.insert(0, str(self.h_tolerance.get()))
         self.h_entry.bind("<Return>", lambda e: self.update_tolerance_from_entry('h'))
+        tk.Checkbutton(self.right_frame, text="Wrap hue through 0/180", variable=self.wrap_hue,
+                       command=self.update_binary_mask).pack()
 
         # Tolerance S
         tk.Label(self.right_frame, text="Tolerance S:").pack()
@@ -108,6 +331,76 @@ class ColorCalibrationApp:
         self.v_entry.insert(0, str(self.v_tolerance.get()))
         self.v_entry.bind("<Return>", lambda e: self.update_tolerance_from_entry('v'))
 
+        # Selected pixel count, answered from the histogram index without thresholding
+        self.coverage_text = tk.StringVar(master, value="Selected: -")
+        tk.Label(self.right_frame, textvariable=self.coverage_text).pack()
+
+        # Additional HSV ranges, all compiled with the slider range into one lookup table
+        ranges_menu = tk.LabelFrame(self.right_frame, text="Additional ranges")
+        ranges_menu.pack(pady=(10, 0), fill="x")
+        self.ranges_listbox = tk.Listbox(ranges_menu, height=4)
+        self.ranges_listbox.pack(fill="x")
+        tk.Button(ranges_menu, text="Add current range", command=self.add_current_range).pack(fill="x")
+        tk.Button(ranges_menu, text="Remove selected", command=self.remove_selected_range).pack(fill="x")
+
+        # Post-processing applied after thresholding, each stage cached separately
+        postprocess_menu = tk.LabelFrame(self.right_frame, text="Post-processing")
+        postprocess_menu.pack(pady=(10, 0), fill="x")
+        self.postprocess_settings = []
+        for name, default, from_, to, resolution in (("Median blur", 5, 1, 31, 2), ("Open", 5, 1, 31, 2),
+                                                     ("Close", 5, 1, 31, 2), ("Min area", 100, 0, 5000, 10)):
+            enabled = tk.BooleanVar(master, value=False)
+            size = tk.IntVar(master, value=default)
+            row = tk.Frame(postprocess_menu)
+            row.pack(fill="x")
+            tk.Checkbutton(row, text=name, variable=enabled, width=10, anchor="w", command=self.update_binary_mask).pack(side=tk.LEFT)
+            tk.Scale(row, from_=from_, to=to, resolution=resolution, orient=tk.HORIZONTAL, variable=size, showvalue=True,
+                     command=lambda value: self.update_binary_mask()).pack(side=tk.LEFT, fill="x", expand=True)
+            self.postprocess_settings.append((enabled, size))
+
+        # Mask composited onto the original picture, sharing mask tiles with the viewer
+        self.overlay = OverlayCompositor()
+        self.overlay_mode = tk.StringVar(master, value="off")
+        self.overlay_alpha = tk.IntVar(master, value=50)
+        self.overlay_color = (255, 0, 0)
+        self.reference_mask = None  # compiled parameter set the diff view compares against
+        self.overlay_stats = tk.StringVar(master, value="")
+        # Overlay masks are computed on their own worker and composited when they arrive
+        self.overlay_scheduler = MaskRenderScheduler(master, self.render_overlay_mask, self.show_overlay_mask, perf=self.perf,
+                                                     name="overlay")
+        self._overlay_request = None
+        self._overlay_result = None
+        overlay_menu = tk.LabelFrame(self.right_frame, text="Overlay")
+        overlay_menu.pack(pady=(10, 0), fill="x")
+        mode_row = tk.Frame(overlay_menu)
+        mode_row.pack(fill="x")
+        for label, value in (("Off", "off"), ("Fill", "fill"), ("Edges", "edges"), ("Diff", "diff")):
+            tk.Radiobutton(mode_row, text=label, value=value, variable=self.overlay_mode,
+                           command=self.display_original_image).pack(side=tk.LEFT)
+        tk.Scale(overlay_menu, from_=0, to=100, orient=tk.HORIZONTAL, label="Opacity %", variable=self.overlay_alpha,
+                 command=lambda value: self.display_original_image()).pack(fill="x")
+        overlay_buttons = tk.Frame(overlay_menu)
+        overlay_buttons.pack(fill="x")
+        tk.Button(overlay_buttons, text="Color...", command=self.choose_overlay_color).pack(side=tk.LEFT, expand=True, fill="x")
+        tk.Button(overlay_buttons, text="Pin as diff reference", command=self.pin_reference).pack(side=tk.LEFT, expand=True, fill="x")
+        tk.Label(overlay_menu, textvariable=self.overlay_stats, justify=tk.LEFT).pack(anchor="w")
+
+        # Include/exclude samples marked on the original picture for automatic tolerances
+        self.sample_mode = tk.StringVar(master, value="pick")
+        self.sample_regions = []  # (kind, x0, y0, x1, y1) in image pixels, inclusive
+        self._drag_start = None
+        self.suggest_text = tk.StringVar(master, value="")
+
+        auto_menu = tk.LabelFrame(self.right_frame, text="Auto tolerance")
+        auto_menu.pack(pady=(10, 0), fill="x")
+        mode_frame = tk.Frame(auto_menu)
+        mode_frame.pack()
+        for text, value in (("Pick", "pick"), ("Include", "include"), ("Exclude", "exclude")):
+            tk.Radiobutton(mode_frame, text=text, variable=self.sample_mode, value=value).pack(side=tk.LEFT)
+        tk.Button(auto_menu, text="Suggest tolerances", command=self.suggest_tolerances).pack(fill="x")
+        tk.Button(auto_menu, text="Clear samples", command=self.clear_samples).pack(fill="x")
+        tk.Label(auto_menu, textvariable=self.suggest_text, justify=tk.LEFT).pack(anchor="w")
+
         mask_menu = tk.LabelFrame(self.right_frame, text="Mask")
         mask_menu.pack(pady=10, fill="x")
 
@@ -117,12 +410,86 @@ class ColorCalibrationApp:
         load_button = tk.Button(mask_menu, text="Load Mask", command=self.load_mask)
         load_button.pack(fill="x")
 
+        # Named, versioned masks in a single library file
+        self.library_path = DEFAULT_LIBRARY
+        self.profile_name = ""
+        library_frame = tk.Frame(mask_menu)
+        library_frame.pack(fill="x")
+        tk.Button(library_frame, text="Save to library", command=self.save_to_library).pack(side=tk.LEFT, expand=True, fill="x")
+        tk.Button(library_frame, text="Load from library", command=self.load_from_library).pack(side=tk.LEFT, expand=True, fill="x")
+        tk.Button(mask_menu, text="Import mask files", command=self.import_mask_files).pack(fill="x")
+
+        # Undo/redo of parameter states; revisited states come straight from the mask cache
+        self.history = ParamHistory()
+        self._history_job = None
+        self._history_state = None  # parameters the pending history job was armed for
+        history_frame = tk.Frame(mask_menu)
+        history_frame.pack(fill="x")
+        tk.Button(history_frame, text="Undo", command=self.undo).pack(side=tk.LEFT, expand=True, fill="x")
+        tk.Button(history_frame, text="Redo", command=self.redo).pack(side=tk.LEFT, expand=True, fill="x")
+        self.cache_stats = tk.StringVar(master, value="")
+        tk.Label(mask_menu, textvariable=self.cache_stats, justify=tk.LEFT).pack(anchor="w")
+        master.bind("<Control-z>", lambda e: self.undo())
+        master.bind("<Control-y>", lambda e: self.redo())
+        master.bind("<Control-Shift-Z>", lambda e: self.redo())
+
+        # Video playback controls, only shown while a video is open
+        self.video_source = None
+        self.video_playing = False
+        self._video_job = None
+        self._video_stats_job = None
+        self._video_scrubbing = False
+        self._show_next_video_frame = False
+        self._next_video_frame_due = 0.0
+        self.threshold_fps = FpsMeter()
+        self.display_fps = FpsMeter()
+        self.preview_fps = FpsMeter()
+        self.video_stats = tk.StringVar(master, value="")
+
+        self.video_frame = tk.LabelFrame(self.right_frame, text="Video")
+        self.play_button = tk.Button(self.video_frame, text="Play", command=self.toggle_video_playback)
+        self.play_button.pack(fill="x")
+        self.video_scale = tk.Scale(self.video_frame, from_=0, to=0, orient=tk.HORIZONTAL, label="Frame")
+        self.video_scale.pack(fill="x")
+        self.video_scale.bind("<ButtonPress-1>", self.start_video_scrub)
+        self.video_scale.bind("<B1-Motion>", self.seek_video)
+        self.video_scale.bind("<ButtonRelease-1>", self.end_video_scrub)
+        tk.Label(self.video_frame, textvariable=self.video_stats, justify=tk.LEFT).pack(anchor="w")
+
+        # Live frames shared by another process, only shown while attached
+        self.shared_source = None
+        self._shared_job = None
+        self._shared_stats_job = None
+        self.shared_stats = tk.StringVar(master, value="")
+        self.write_back = tk.BooleanVar(master, value=True)
+        self.shared_frame = tk.LabelFrame(self.right_frame, text="Live frames")
+        tk.Checkbutton(self.shared_frame, text="Write thresholds back", variable=self.write_back,
+                       command=self.update_binary_mask).pack(anchor="w")
+        tk.Button(self.shared_frame, text="Detach", command=self.close_shared_frames).pack(fill="x")
+        tk.Label(self.shared_frame, textvariable=self.shared_stats, justify=tk.LEFT).pack(anchor="w")
+
         menubar = tk.Menu(master)
         file_menu = tk.Menu(menubar, tearoff=0)
         file_menu.add_command(label="open image", command=self.load_image)
+        file_menu.add_command(label="open video", command=self.load_video)
+        file_menu.add_command(label="open calibration set", command=self.open_calibration_set)
+        file_menu.add_command(label="attach shared frames", command=self.attach_shared_frames)
+        file_menu.add_command(label="open mask library", command=self.choose_library)
+        file_menu.add_command(label="export performance trace", command=self.export_perf_trace)
+        file_menu.add_command(label="export performance profile", command=lambda: self.export_perf_trace(chrome_trace=False))
         file_menu.add_separator()
         file_menu.add_command(label="quit", command=master.quit)
         menubar.add_cascade(label="File", menu=file_menu)
+        view_menu = tk.Menu(menubar, tearoff=0)
+        view_menu.add_command(label="fit to window", command=self.fit_original_to_window)
+        view_menu.add_command(label="actual size", command=self.zoom_original_actual_size)
+        view_menu.add_separator()
+        self.show_perf_overlay = tk.BooleanVar(master, value=False)
+        self._perf_overlay_job = None
+        view_menu.add_checkbutton(label="performance overlay", variable=self.show_perf_overlay, accelerator="F3",
+                                  command=self.toggle_perf_overlay)
+        master.bind("<F3>", lambda e: (self.show_perf_overlay.set(not self.show_perf_overlay.get()), self.toggle_perf_overlay()))
+        menubar.add_cascade(label="View", menu=view_menu)
         master.config(menu=menubar)
         master.bind("<Configure>", self.on_resize)
 
@@ -145,20 +512,270 @@ class ColorCalibrationApp:
             pass  # ignore errors
 
     def on_resize(self, event):
+        # <Configure> fires for every child widget, redraw once the burst is over
         if self.original_image is not None:
-            self.display_original_image()
-            self.update_binary_mask()
+            if self._resize_job is not None:
+                self.master.after_cancel(self._resize_job)
+            self._resize_job = self.master.after(30, self.apply_resize)
+
+    def apply_resize(self):
+        self._resize_job = None
+        self.display_original_image()
+        self.update_binary_mask()
 
-    def load_image(self):
-        file_path = filedialog.askopenfilename()
+    def load_image(self, file_path=None):
+        if file_path is None:
+            file_path = filedialog.askopenfilename()
         if file_path:
-            self.original_image = cv2.imread(file_path)
-            if self.original_image is not None:
-                height, width = self.original_image.shape[:2]
-                self.original_canvas.config(width=width, height=height)
-                self.binary_canvas.config(width=int(width * 0.1 / 0.9), height=int(height * 0.1 / 0.9)) # Adjust binary canvas size
-                self.display_original_image()
-                self.update_binary_mask()
+            if self.image_load is not None:
+                self.image_load.cancel()
+            # Decoding and pyramids run on a loader thread. JPEGs show a reduced decode first; very
+            # large images end up in a memory-mapped backing store, .npy files are mapped directly.
+            screen_size = (self.master.winfo_screenwidth(), self.master.winfo_screenheight())
+            self.image_load = AsyncImageLoad(file_path, screen_size, prepare=prepare_image, prepare_preview=prepare_video_frame)
+            self.load_progress["value"] = 0
+            self.load_status.set(f"Loading {os.path.basename(file_path)}...")
+            self.load_frame.pack(before=self.original_canvas)
+            if self._image_load_job is None:
+                self._image_load_job = self.master.after(50, self.poll_image_load)
+
+    def poll_image_load(self):
+        load = self.image_load
+        finished = load.finished  # checked before draining, so no late event is missed
+        for kind, value, prepared in load.events():
+            if kind == "error":
+                messagebox.showerror("Error", f"Cannot open image: {value}")
+            elif kind == "preview":
+                self.set_image(value, prepared)
+                self._preview_load = load
+                self.original_label.config(text="Original Picture (preview)")
+            else:
+                self.set_image(value, prepared, replace=self._preview_load is load)
+                self._preview_load = None
+                self.original_label.config(text="Original Picture")
+        self.load_progress["value"] = load.progress
+        self.load_status.set(f"{os.path.basename(load.file_path)}: {load.stage}")
+        if finished:
+            self.image_load = None
+            self._image_load_job = None
+            self.load_frame.pack_forget()
+        else:
+            self._image_load_job = self.master.after(50, self.poll_image_load)
+
+    def set_image(self, image, prepared=None, replace=False):
+        # replace: the same picture at another resolution (the full decode after a preview), so
+        # the view and the samples are scaled instead of reset
+        factor = image.shape[1] / self.original_image.shape[1] if replace and self.original_image is not None else None
+        self.original_image = image
+        self.close_video()
+        self.close_shared_frames()
+        self.image_generation += 1
+        self.original_tile_cache.clear()
+        self.mask_cache.clear()
+        if prepared is None:
+            self.build_pyramids()
+        else:
+            image_pyramid, hsv_pyramid, self.hsv_index = prepared
+            self.set_pyramids(image_pyramid, hsv_pyramid)
+
+        if factor is not None:
+            # The zoomed plane keeps its size, so the origin stays valid
+            self.original_viewport.zoom /= factor
+            height, width = image.shape[:2]
+            self.sample_regions = [(kind, int(x0 * factor), int(y0 * factor),
+                                    min(width - 1, int((x1 + 1) * factor) - 1), min(height - 1, int((y1 + 1) * factor) - 1))
+                                   for kind, x0, y0, x1, y1 in self.sample_regions]
+        else:
+            self.reset_view()
+            height, width = self.original_image.shape[:2]
+            # Request at most a screen-sized canvas, gigapixel images are viewed through zoom and pan
+            width = min(width, self.master.winfo_screenwidth())
+            height = min(height, self.master.winfo_screenheight())
+            self.original_canvas.config(width=width, height=height)
+            self.binary_canvas.config(width=int(width * 0.1 / 0.9), height=int(height * 0.1 / 0.9)) # Adjust binary canvas size
+        self.display_original_image()
+        self.update_binary_mask()
+
+    def load_video(self):
+        file_path = filedialog.askopenfilename(filetypes=[("Video", "*.mp4 *.avi *.mov *.mkv"), ("All files", "*.*")])
+        if file_path:
+            try:
+                # Pyramids are built on the decode thread, ahead of playback
+                source = VideoFrameSource(file_path, prepare=prepare_video_frame)
+            except ValueError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            self.close_video()
+            self.close_shared_frames()
+            self.reset_view()
+            self.video_source = source
+            self.video_playing = False
+            self._show_next_video_frame = True
+            self._next_video_frame_due = 0.0
+            self.play_button.config(text="Play")
+            self.video_scale.config(to=max(source.frame_count - 1, 0))
+            self.video_scale.set(0)
+            self.video_frame.pack(pady=10, fill="x")
+            self._video_job = self.master.after(1, self.video_tick)
+            self._video_stats_job = self.master.after(500, self.update_video_stats)
+
+    def close_video(self):
+        if self.video_source is not None:
+            self.master.after_cancel(self._video_job)
+            self.master.after_cancel(self._video_stats_job)
+            self.video_source.close()
+            self.video_source = None
+            self.video_frame.pack_forget()
+
+    def toggle_video_playback(self):
+        self.video_playing = not self.video_playing
+        self._next_video_frame_due = time.perf_counter()
+        self.play_button.config(text="Pause" if self.video_playing else "Play")
+
+    def start_video_scrub(self, event):
+        self._video_scrubbing = True
+
+    def seek_video(self, event=None):
+        self.video_source.seek(int(self.video_scale.get()))
+        self._show_next_video_frame = True
+
+    def end_video_scrub(self, event):
+        self._video_scrubbing = False
+        self.seek_video()
+
+    def video_tick(self):
+        source = self.video_source
+        now = time.perf_counter()
+        if self._show_next_video_frame or (self.video_playing and now >= self._next_video_frame_due):
+            item = source.get()
+            if item is not None:
+                index, frame, prepared = item
+                self._show_next_video_frame = False
+                # Keep the nominal frame rate, but never try to catch up on frames we fell behind on
+                self._next_video_frame_due = max(self._next_video_frame_due + 1 / source.fps, now)
+                self.show_video_frame(index, frame, prepared)
+            elif source.finished and self.video_playing:
+                self.toggle_video_playback()
+        self._video_job = self.master.after(5, self.video_tick)
+
+    def show_video_frame(self, index, frame, prepared):
+        self.show_prepared_frame(frame, prepared)
+        if not self._video_scrubbing:
+            self.video_scale.set(index)
+
+    def show_prepared_frame(self, frame, prepared):
+        image_pyramid, hsv_pyramid, hsv_index = prepared
+        self.original_image = frame
+        self.image_generation += 1
+        self.set_pyramids(image_pyramid, hsv_pyramid)
+        self.hsv_index = hsv_index
+        self.display_original_image()
+        self.display_fps.tick()
+        self.update_binary_mask()
+
+    def update_video_stats(self):
+        self.video_stats.set(f"decode: {self.video_source.decode_fps.rate():.1f} fps\n"
+                             f"threshold: {self.threshold_fps.rate():.1f} fps\n"
+                             f"display: {self.display_fps.rate():.1f} fps")
+        self._video_stats_job = self.master.after(500, self.update_video_stats)
+
+    def attach_shared_frames(self):
+        name = simpledialog.askstring("Attach shared frames", "Shared memory name:", initialvalue=SHARED_FRAMES_NAME,
+                                      parent=self.master)
+        if not name:
+            return
+        try:
+            # Frames are copied out of the publisher's shared memory and their pyramids built on
+            # the polling thread
+            source = SharedFrameSource(name, prepare=prepare_video_frame)
+        except (FileNotFoundError, ValueError) as e:
+            messagebox.showerror("Error", f"Cannot attach to {name}: {e}")
+            return
+        self.close_video()
+        self.close_shared_frames()
+        self.reset_view()
+        self.shared_source = source
+        self.shared_frame.pack(pady=10, fill="x")
+        self._shared_job = self.master.after(1, self.shared_frames_tick)
+        self._shared_stats_job = self.master.after(500, self.update_shared_stats)
+        self.update_binary_mask()
+
+    def close_shared_frames(self):
+        if self.shared_source is not None:
+            self.master.after_cancel(self._shared_job)
+            self.master.after_cancel(self._shared_stats_job)
+            self.shared_source.close()
+            self.shared_source = None
+            self.shared_frame.pack_forget()
+
+    def shared_frames_tick(self):
+        item = self.shared_source.get()
+        if item is not None:
+            _, frame, prepared = item
+            self.show_prepared_frame(frame, prepared)
+        self._shared_job = self.master.after(5, self.shared_frames_tick)
+
+    def update_shared_stats(self):
+        source = self.shared_source
+        self.shared_stats.set(f"{source.buffer.width}x{source.buffer.height} frames\n"
+                              f"received: {source.receive_fps.rate():.1f} fps, {source.dropped} dropped\n"
+                              f"threshold: {self.threshold_fps.rate():.1f} fps\n"
+                              f"display: {self.display_fps.rate():.1f} fps")
+        self._shared_stats_job = self.master.after(500, self.update_shared_stats)
+
+    def toggle_perf_overlay(self):
+        if self._perf_overlay_job is not None:
+            self.master.after_cancel(self._perf_overlay_job)
+            self._perf_overlay_job = None
+        self.original_canvas.delete("perf_overlay")
+        if self.show_perf_overlay.get():
+            self.update_perf_overlay()
+
+    def update_perf_overlay(self):
+        summary = self.perf.summary()
+        lines = [f"preview {self.preview_fps.rate():5.1f} fps   threshold {self.threshold_fps.rate():5.1f} fps",
+                 f"{'stage':<24}{'p50':>7}{'p90':>7}{'p99':>7} ms{'count':>8}"]
+        for name, stats in sorted(summary["stages"].items()):
+            lines.append(f"{name:<24}{stats['p50_ms']:7.1f}{stats['p90_ms']:7.1f}{stats['p99_ms']:7.1f}   {stats['count']:8}")
+        counters = dict(summary["counters"])
+        if self.shared_source is not None:
+            counters["shared.dropped"] = self.shared_source.dropped
+        lines += [f"{name:<24}{value:>10}" for name, value in sorted(counters.items())]
+
+        self.original_canvas.delete("perf_overlay")
+        text = self.original_canvas.create_text(8, 8, anchor=tk.NW, text="\n".join(lines), fill="#7CFC00",
+                                                font=("Courier", 9), tags="perf_overlay")
+        x0, y0, x1, y1 = self.original_canvas.bbox(text)
+        background = self.original_canvas.create_rectangle(x0 - 4, y0 - 4, x1 + 4, y1 + 4, fill="black", outline="",
+                                                           stipple="gray75", tags="perf_overlay")
+        self.original_canvas.tag_lower(background, text)
+        self.original_canvas.tag_raise("perf_overlay")
+        self._perf_overlay_job = self.master.after(500, self.update_perf_overlay)
+
+    def export_perf_trace(self, chrome_trace=True):
+        file_path = filedialog.asksaveasfilename(defaultextension=".json", filetypes=[("JSON", "*.json")],
+                                                 initialfile="calibration-trace.json" if chrome_trace else "calibration-profile.json")
+        if file_path:
+            try:
+                # Chrome traces open in chrome://tracing or Perfetto
+                if chrome_trace:
+                    self.perf.export_chrome_trace(file_path)
+                else:
+                    self.perf.export_json(file_path)
+            except OSError as e:
+                messagebox.showerror("Error", f"An error occurred while exporting the trace: {e}")
+
+    def build_pyramids(self):
+        # HSV is computed once per image; every preview works on a level of this pyramid
+        with self.perf.stage("load.pyramids"):
+            self.set_pyramids(*build_pyramids(self.original_image))
+        with self.perf.stage("load.histogram_index"):
+            self.hsv_index = HsvHistogramIndex(self.hsv_image)
+
+    def set_pyramids(self, image_pyramid, hsv_pyramid):
+        self.image_pyramid = image_pyramid
+        self.hsv_pyramid = hsv_pyramid
+        self.hsv_image = hsv_pyramid[0]
 
     def display_original_image(self):
         if self.original_image is not None:
@@ -166,20 +783,267 @@ class ColorCalibrationApp:
             canvas_height = self.original_canvas.winfo_height()
             if canvas_width > 1 and canvas_height > 1:
                 img_height, img_width = self.original_image.shape[:2]
-                scale = min(canvas_width / img_width, canvas_height / img_height)
-                new_width = int(img_width * scale)
-                new_height = int(img_height * scale)
+                self.original_viewport.update(img_width, img_height, canvas_width, canvas_height)
+                state = self.original_viewport.state()
+
+                # The overlay mask of this view is computed off the Tk thread; until it arrives the
+                # picture is shown without it
+                overlay = self.overlay_params()
+                composite = None
+                if overlay is not None:
+                    request = (self.image_generation, state, overlay[0])
+                    if request != self._overlay_request:
+                        self._overlay_request = request
+                        self.overlay_scheduler.submit((self.hsv_pyramid, request) + overlay[1:])
+                    composite = self.overlay_composite(state)
+
+                # Nothing to do when neither the image, the view geometry nor the overlay changed
+                key = (self.image_generation,) + state + (composite and composite[0],)
+                if self.original_view.is_current(key):
+                    self.perf.count("original.unchanged")
+                    return
+
+                # Canvas <-> image mapping used for picking and drawing samples
+                self.img_scale = state[0]
+                self.img_offset_x = -state[1]
+                self.img_offset_y = -state[2]
+
+                with self.perf.stage("original.render"):
+                    self._original_buffer, _ = render_viewport(self.image_pyramid, state, self.bgr_tile_to_rgb, self.original_tile_cache,
+                                                               self.image_generation, out=self._original_buffer)
+                x0, y0, x1, y1 = self.original_viewport.visible_rect()
+                view = self._original_buffer[y0:y1, x0:x1]
+                if composite is not None:
+                    view = self.composite_overlay(view, (x0, y0, x1, y1), *composite[1:])
+                else:
+                    self.overlay_stats.set("")
+                with self.perf.stage("original.show"):
+                    self.original_view.show(view, x0, y0, key)
+                self.draw_samples()
+                self.draw_viewport_outline()
+
+    def overlay_params(self):
+        # (mask key, compiled mask, reference mask, post-processing) for the overlay, None when it is off
+        mode = self.overlay_mode.get()
+        if mode == "off":
+            return None
+        try:
+            compiled_mask = self.compile_pairs([self.current_range()] + self.extra_ranges)
+        except ValueError:
+            return None
+        reference = None
+        if mode == "diff":
+            if self.reference_mask is None:
+                return None
+            reference = self.reference_mask
+        postprocess = self.build_postprocess()
+        key = (tuple(compiled_mask.ranges), reference and tuple(reference.ranges), postprocess.key())
+        return key, compiled_mask, reference, postprocess
+
+    def overlay_composite(self, state):
+        # (key, mode, mask, reference mask) to composite from the last delivered overlay masks, None
+        # while no mask for this image and view geometry has arrived. The last masks stay on screen
+        # while newer parameters are being computed.
+        if self._overlay_result is None:
+            return None
+        request, mask, reference_mask = self._overlay_result
+        mode = self.overlay_mode.get()
+        if request[:2] != (self.image_generation, state) or (mode == "diff" and reference_mask is None):
+            return None
+        key = (request, mode, self.overlay_alpha.get(), self.overlay_color)
+        return key, mode, mask, reference_mask
+
+    def render_overlay_mask(self, params, quality):
+        # Runs on the overlay worker. Masks are computed at display resolution for the visible part only.
+        hsv_pyramid, request, compiled_mask, reference, postprocess = params
+        generation, state = request[:2]
+        with self.perf.stage("overlay.mask"):
+            mask = self.viewport_mask(hsv_pyramid, (generation, tuple(compiled_mask.ranges)), compiled_mask,
+                                      postprocess, state, quality)
+            if mask is None:
+                return None
+            reference_mask = None
+            if reference is not None:
+                reference_mask = self.viewport_mask(hsv_pyramid, (generation, tuple(reference.ranges)), reference,
+                                                    postprocess, state, quality)
+        return request, mask, reference_mask
+
+    def show_overlay_mask(self, result, quality):
+        self._overlay_result = result
+        self.display_original_image()
+
+    def composite_overlay(self, rgb, rect, mode, mask, reference_mask):
+        x0, y0, x1, y1 = rect
+        alpha = self.overlay_alpha.get() / 100
+        with self.perf.stage("overlay.composite"):
+            if mode == "fill":
+                self.overlay_stats.set("")
+                return self.overlay.fill(rgb, mask[y0:y1, x0:x1], self.overlay_color, alpha)
+            if mode == "edges":
+                self.overlay_stats.set("")
+                return self.overlay.edges(rgb, mask[y0:y1, x0:x1], self.overlay_color)
+            out, added, removed = self.overlay.diff(rgb, mask[y0:y1, x0:x1], reference_mask[y0:y1, x0:x1], max(alpha, 0.2))
+        self.overlay_stats.set(f"vs reference: +{added:,} / -{removed:,} display px\n(green added, magenta removed)")
+        return out
+
+    def viewport_mask(self, hsv_pyramid, cache_key, compiled_mask, postprocess, state, quality="full", out=None):
+        # Mask of a viewport state, shared by the binary preview, the viewer and the overlay: the
+        # thresholded tiles of a pyramid level and the post-processed views are cached under the
+        # same keys, so each is computed once for all views that read them. The "fast" quality reads
+        # two pyramid levels coarser; None is returned for a "full" pass that would read the same
+        # level as the fast one, or for an empty view.
+        level_offset = 2 if quality == "fast" else 0
+        if quality != "fast" and viewport_level(hsv_pyramid, state[0]) == viewport_level(hsv_pyramid, state[0], 2):
+            return None
+        mask, level_index = render_viewport(hsv_pyramid, state, compiled_mask.apply, self.mask_cache, cache_key, level_offset,
+                                            out=out, source_cache=self.mask_cache, binary=True)
+        if mask is None:
+            return None
+        # Post-processing runs on the composited view rather than per tile, so it has no tile seams
+        return postprocess.run(mask, (cache_key, state, level_index), self.mask_cache, scale=state[0])
+
+    def choose_overlay_color(self):
+        color, _ = colorchooser.askcolor(color="#%02x%02x%02x" % self.overlay_color, parent=self.master)
+        if color is not None:
+            self.overlay_color = tuple(int(c) for c in color)
+            self.display_original_image()
+
+    def pin_reference(self):
+        try:
+            self.reference_mask = self.compile_pairs([self.current_range()] + self.extra_ranges)
+        except ValueError:
+            messagebox.showwarning("Error", "No color selected yet.")
+            return
+        self.overlay_mode.set("diff")
+        self.display_original_image()
+
+    @staticmethod
+    def bgr_tile_to_rgb(tile):
+        return cv2.cvtColor(tile, cv2.COLOR_BGR2RGB)
+
+    def on_canvas_wheel(self, event):
+        if self.original_image is not None:
+            factor = 1.25 if event.num == 4 or event.delta > 0 else 0.8
+            self.original_viewport.zoom_at(factor, event.x, event.y)
+            self.display_original_image()
 
-                # Offset to center image if canvas is bigger
-                self.img_offset_x = (canvas_width - new_width) // 2
-                self.img_offset_y = (canvas_height - new_height) // 2
-                self.img_scale = scale
+    def on_pan_start(self, event):
+        self._pan_anchor = (event.x, event.y)
 
-                resized = cv2.resize(self.original_image, (new_width, new_height), interpolation=cv2.INTER_AREA)
-                self.original_image_tk = self.convert_cv2_to_tkinter(resized)
-                self.original_canvas.delete("all")
-                self.original_canvas.create_image(self.img_offset_x, self.img_offset_y, anchor=tk.NW, image=self.original_image_tk)
+    def on_pan_drag(self, event):
+        if self.original_image is not None and self._pan_anchor is not None:
+            self.original_viewport.pan(event.x - self._pan_anchor[0], event.y - self._pan_anchor[1])
+            self._pan_anchor = (event.x, event.y)
+            self.display_original_image()
 
+    def fit_original_to_window(self):
+        self.original_viewport.fit_to_window()
+        self.display_original_image()
+
+    def zoom_original_actual_size(self):
+        canvas_width, canvas_height = self.original_viewport.canvas_size
+        self.original_viewport.zoom_at(1 / self.original_viewport.zoom, canvas_width // 2, canvas_height // 2)
+        self.display_original_image()
+
+    def draw_viewport_outline(self):
+        # Outline of the zoomed-in region on the binary mask overview
+        self.binary_canvas.delete("viewport")
+        if self.original_viewport.fit:
+            return
+        img_width, img_height = self.original_viewport.image_size
+        scale = min(self.binary_canvas.winfo_width() / img_width, self.binary_canvas.winfo_height() / img_height, 1.0)
+        canvas_width, canvas_height = self.original_viewport.canvas_size
+        x0, y0 = self.original_viewport.to_image(0, 0)
+        x1, y1 = self.original_viewport.to_image(canvas_width, canvas_height)
+        self.binary_canvas.create_rectangle(max(x0, 0) * scale, max(y0, 0) * scale, min(x1, img_width) * scale, min(y1, img_height) * scale,
+                                            outline="#ff8000", width=2, tags="viewport")
+
+    def canvas_to_image(self, x, y):
+        return int((x - self.img_offset_x) / self.img_scale), int((y - self.img_offset_y) / self.img_scale)
+
+    def on_canvas_press(self, event):
+        if self.sample_mode.get() == "pick":
+            self.pick_color(event)
+        elif self.original_image is not None and hasattr(self, 'img_scale'):
+            self._drag_start = (event.x, event.y)
+            color = "#00ff00" if self.sample_mode.get() == "include" else "#ff0000"
+            self.original_canvas.create_rectangle(event.x, event.y, event.x, event.y, outline=color, dash=(4, 2), tags="drag")
+
+    def on_canvas_drag(self, event):
+        if self._drag_start is not None:
+            self.original_canvas.coords("drag", *self._drag_start, event.x, event.y)
+
+    def on_canvas_release(self, event):
+        if self._drag_start is None:
+            return
+        self.original_canvas.delete("drag")
+        # A click without dragging marks a single pixel
+        x0, y0 = self.canvas_to_image(*self._drag_start)
+        x1, y1 = self.canvas_to_image(event.x, event.y)
+        self._drag_start = None
+        h, w = self.original_image.shape[:2]
+        x0, x1 = max(0, min(x0, x1)), min(w - 1, max(x0, x1))
+        y0, y1 = max(0, min(y0, y1)), min(h - 1, max(y0, y1))
+        if x0 <= x1 and y0 <= y1:
+            self.sample_regions.append((self.sample_mode.get(), x0, y0, x1, y1))
+            self.draw_samples()
+
+    def draw_samples(self):
+        self.original_canvas.delete("sample")
+        for kind, x0, y0, x1, y1 in self.sample_regions:
+            color = "#00ff00" if kind == "include" else "#ff0000"
+            self.original_canvas.create_rectangle(x0 * self.img_scale + self.img_offset_x, y0 * self.img_scale + self.img_offset_y,
+                                                  (x1 + 1) * self.img_scale + self.img_offset_x, (y1 + 1) * self.img_scale + self.img_offset_y,
+                                                  outline=color, width=2, tags="sample")
+
+    def reset_view(self):
+        # Samples and zoom of the previous picture do not carry over to a different source
+        self.clear_samples()
+        self.original_viewport = Viewport()
+
+    def clear_samples(self):
+        self.sample_regions = []
+        self.original_canvas.delete("sample")
+        self.suggest_text.set("")
+
+    def suggest_tolerances(self):
+        if self.original_image is None:
+            return
+        samples = {"include": [], "exclude": []}
+        for kind, x0, y0, x1, y1 in self.sample_regions:
+            samples[kind].append(self.hsv_image[y0:y1 + 1, x0:x1 + 1].reshape(-1, 3))
+        if not samples["include"]:
+            messagebox.showwarning("No samples", "Mark at least one include point or region first.")
+            return
+
+        exclude = np.concatenate(samples["exclude"]) if samples["exclude"] else None
+        # Video frames, shared frames and previews have an index of a reduced level
+        height, width = self.hsv_image.shape[:2]
+        try:
+            lower, upper, included, excluded = suggest_bounds(np.concatenate(samples["include"]), exclude, self.hsv_index,
+                                                              image_pixels=height * width)
+        except ValueError:
+            # Regions marked outside the current frame select no pixels
+            messagebox.showwarning("No samples", "Mark at least one include point or region first.")
+            return
+
+        # The mask is stored as a center color and symmetric tolerances; hue is measured around
+        # the circle, since the best interval may wrap through 0/180
+        center = (lower + upper) // 2
+        tolerance = upper - center
+        hue_width = (upper[0] - lower[0]) % 180
+        center[0] = (lower[0] + hue_width // 2) % 180
+        tolerance[0] = hue_width - hue_width // 2
+        if lower[0] > upper[0]:
+            self.wrap_hue.set(True)
+        self.hsv_value.set(f"H: {center[0]}, S: {center[1]}, V: {center[2]}")
+        self.h_tolerance.set(int(tolerance[0]))
+        self.s_tolerance.set(int(tolerance[1]))
+        self.v_tolerance.set(int(tolerance[2]))
+        self.update_mask_from_sliders()
+
+        excluded_label = "Excluded" if exclude is not None else "Rest of image"
+        self.suggest_text.set(f"Included: {included:.1%}\n{excluded_label}: {excluded:.1%}")
 
     def pick_color(self, event):
         if self.original_image is not None and hasattr(self, 'img_scale'):
@@ -187,8 +1051,7 @@ class ColorCalibrationApp:
             y = int((event.y - self.img_offset_y) / self.img_scale)
             h, w = self.original_image.shape[:2]
             if 0 <= x < w and 0 <= y < h:
-                b, g, r = self.original_image[y, x]
-                hsv = cv2.cvtColor(np.uint8([[[b, g, r]]]), cv2.COLOR_BGR2HSV)[0][0]
+                hsv = self.hsv_image[y, x]
                 self.hsv_value.set(f"H: {hsv[0]}, S: {hsv[1]}, V: {hsv[2]}")
                 self.update_binary_mask()
 
@@ -206,53 +1069,182 @@ class ColorCalibrationApp:
 
         self.update_binary_mask()
 
+    def current_range(self):
+        # Picked color and tolerances of the sliders; raises ValueError before a color is picked
+        hsv_str = self.hsv_value.get()
+        h = int(hsv_str.split(',')[0].split(':')[1].strip())
+        s = int(hsv_str.split(',')[1].split(':')[1].strip())
+        v = int(hsv_str.split(',')[2].split(':')[1].strip())
+        return (h, s, v), (self.h_tolerance.get(), self.s_tolerance.get(), self.v_tolerance.get())
+
+    def compile_pairs(self, pairs):
+        return CompiledMask.from_pairs(pairs, self.wrap_hue.get())
+
+    def add_current_range(self):
+        try:
+            self.extra_ranges.append(self.current_range())
+        except ValueError:
+            messagebox.showwarning("Error", "No color selected yet.")
+            return
+        self.refresh_ranges_list()
+        self.update_binary_mask()
+
+    def remove_selected_range(self):
+        for index in reversed(self.ranges_listbox.curselection()):
+            del self.extra_ranges[index]
+        self.refresh_ranges_list()
+        self.update_binary_mask()
+
+    def refresh_ranges_list(self):
+        self.ranges_listbox.delete(0, tk.END)
+        for (h, s, v), (h_tol, s_tol, v_tol) in self.extra_ranges:
+            self.ranges_listbox.insert(tk.END, f"H {h}±{h_tol}, S {s}±{s_tol}, V {v}±{v_tol}")
+
+    def mask_state(self):
+        center, tolerance = self.current_range()
+        extra_ranges = tuple((tuple(c), tuple(t)) for c, t in self.extra_ranges)
+        return (tuple(center), tuple(tolerance)), extra_ranges, self.wrap_hue.get()
+
+    def record_history(self):
+        self._history_job = None
+        try:
+            self.history.push(self.mask_state())
+        except ValueError:
+            pass
+
+    def restore_state(self, state):
+        if state is None:
+            return
+        (center, tolerance), extra_ranges, wrap_hue = state
+        self.wrap_hue.set(wrap_hue)
+        self.hsv_value.set(f"H: {center[0]}, S: {center[1]}, V: {center[2]}")
+        self.h_tolerance.set(tolerance[0])
+        self.s_tolerance.set(tolerance[1])
+        self.v_tolerance.set(tolerance[2])
+        self.extra_ranges = list(extra_ranges)
+        self.refresh_ranges_list()
+        self.update_mask_from_sliders()
+
+    def undo(self):
+        # Record a pending change first, so undo goes back from what is on screen
+        if self._history_job is not None:
+            self.master.after_cancel(self._history_job)
+            self.record_history()
+        self.restore_state(self.history.undo())
+
+    def redo(self):
+        self.restore_state(self.history.redo())
+
+    def build_postprocess(self):
+        (median_on, median_size), (open_on, open_size), (close_on, close_size), (area_on, min_area) = self.postprocess_settings
+        stages = []
+        if median_on.get():
+            stages.append(MedianBlur(median_size.get()))
+        if open_on.get():
+            stages.append(Morphology("open", open_size.get()))
+        if close_on.get():
+            stages.append(Morphology("close", close_size.get()))
+        if area_on.get():
+            stages.append(MinAreaFilter(min_area.get()))
+        return PostProcessPipeline(stages)
+
+    def update_calibration_set(self):
+        if self._calibration_set_update is not None:
+            try:
+                compiled_mask = self.compile_pairs([self.current_range()] + self.extra_ranges)
+            except ValueError:
+                return
+            self._calibration_set_update(compiled_mask, self.build_postprocess())
+
     def update_binary_mask(self):
+        self.update_calibration_set()
+        if self.overlay_mode.get() != "off":
+            self.display_original_image()
         if self.original_image is not None:
             try:
-                hsv_str = self.hsv_value.get()
-                h = int(hsv_str.split(',')[0].split(':')[1].strip())
-                s = int(hsv_str.split(',')[1].split(':')[1].strip())
-                v = int(hsv_str.split(',')[2].split(':')[1].strip())
-                h_tol = self.h_tolerance.get()
-                s_tol = self.s_tolerance.get()
-                v_tol = self.v_tolerance.get()
-
-                lower_bound = np.array([max(0, h - h_tol), max(0, s - s_tol), max(0, v - v_tol)])
-                upper_bound = np.array([min(180, h + h_tol), min(255, s + s_tol), min(255, v + v_tol)])
-
-                hsv_img = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2HSV)
-                mask = cv2.inRange(hsv_img, lower_bound, upper_bound)
-                binary_image = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)
+                # With wrap_hue, red hues on both sides of the 0/180 seam can be selected
+                pairs = [self.current_range()] + self.extra_ranges
+                compiled_mask = self.compile_pairs(pairs)
+                if self.shared_source is not None and self.write_back.get():
+                    # The publishing process picks these up on its next frame
+                    self.shared_source.write_thresholds(pairs, self.wrap_hue.get())
+                self.update_coverage(compiled_mask)
+
+                # Slider drags are recorded as one history step once they settle. Only parameter
+                # changes re-arm the timer: new video or shared frames arrive faster than it fires.
+                state = self.mask_state()
+                if state != self._history_state:
+                    self._history_state = state
+                    if self._history_job is not None:
+                        self.master.after_cancel(self._history_job)
+                    self._history_job = self.master.after(400, self.record_history)
 
                 canvas_width = self.binary_canvas.winfo_width()
                 canvas_height = self.binary_canvas.winfo_height()
                 if canvas_width > 1 and canvas_height > 1:
-                    img_resized = self.resize_image(binary_image, canvas_width, canvas_height)
-                    self.binary_image_tk = self.convert_cv2_to_tkinter(img_resized)
-                    self.binary_canvas.create_image(0, 0, anchor=tk.NW, image=self.binary_image_tk)
+                    postprocess = self.build_postprocess()
+                    request = (self.image_generation, tuple(compiled_mask.ranges), postprocess.key(), canvas_width, canvas_height)
+                    if request == self._binary_request:
+                        return
+                    self._binary_request = request
+                    self.mask_scheduler.submit((self.hsv_pyramid, self.image_generation, compiled_mask, postprocess,
+                                                self.preview_state(canvas_width, canvas_height)))
 
             except ValueError:
                 pass
 
+    def update_coverage(self, compiled_mask):
+        if self.hsv_index is None:
+            return
+        coverage = self.hsv_index.coverage_union(compiled_mask.boxes())
+        height, width = self.original_image.shape[:2]
+        approximate = "~" if self.hsv_index.bins != FULL_BINS else ""
+        self.coverage_text.set(f"Selected: {approximate}{round(coverage * width * height):,} px ({coverage:.2%})")
+
+    def preview_state(self, canvas_width, canvas_height):
+        # Viewport state of the binary preview: the whole image fitted into the canvas, never upscaled
+        img_height, img_width = self.original_image.shape[:2]
+        scale = min(canvas_width / img_width, canvas_height / img_height, 1.0)
+        return scale, 0, 0, max(1, int(img_width * scale)), max(1, int(img_height * scale))
+
+    def render_mask_preview(self, params, quality):
+        # Runs on the render worker: only touches numpy/OpenCV data captured in params. The preview
+        # is a fitted viewport, so its tiles are shared with the overlay and the viewer whenever
+        # they read the same pyramid level.
+        hsv_pyramid, generation, compiled_mask, postprocess, state = params
+        with self.perf.stage("preview.mask"):
+            mask = self.viewport_mask(hsv_pyramid, (generation, tuple(compiled_mask.ranges)), compiled_mask, postprocess,
+                                      state, quality)
+        if mask is None:
+            return None
+        self.threshold_fps.tick()
+        return mask
+
+    def show_binary_mask(self, mask, quality):
+        with self.perf.stage("preview.show"):
+            self.binary_view.show(mask)
+        self.preview_fps.tick()
+        self.binary_canvas.tag_raise("viewport")
+        self.cache_stats.set(f"Cache: {len(self.mask_cache)} masks, {self.mask_cache.nbytes / 1e6:.1f} MB\n"
+                             f"hit rate {self.mask_cache.hit_rate():.0%}")
+
+    def render_mask_viewport(self, params, quality):
+        # Runs on the render worker
+        hsv_pyramid, compiled_mask, postprocess, cache_key, state = params
+        with self.perf.stage("viewer.mask"):
+            mask = self.viewport_mask(hsv_pyramid, cache_key, compiled_mask, postprocess, state, quality)
+        if mask is None:
+            return None
+        self.threshold_fps.tick()
+        img_height, img_width = hsv_pyramid[0].shape[:2]
+        x0, y0, x1, y1 = visible_rect(state, img_width, img_height)
+        return mask[y0:y1, x0:x1], x0, y0
+
     def save_mask(self):
         file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text file", "*.txt")])
         if file_path:
             try:
-                hsv_str = self.hsv_value.get()
-                h = int(hsv_str.split(',')[0].split(':')[1].strip())
-                s = int(hsv_str.split(',')[1].split(':')[1].strip())
-                v = int(hsv_str.split(',')[2].split(':')[1].strip())
-                h_tol = self.h_tolerance.get()
-                s_tol = self.s_tolerance.get()
-                v_tol = self.v_tolerance.get()
-
-                lower_bound = [max(0, h), max(0, s), max(0, v)]
-                upper_bound = [min(180, h_tol), min(255, s_tol), min(255, v_tol)]
-
-                with open(file_path, 'w') as f:
-                    f.write(f"{lower_bound[0]},{lower_bound[1]},{lower_bound[2]}\n")
-                    f.write(f"{upper_bound[0]},{upper_bound[1]},{upper_bound[2]}\n")
-
+                write_mask_file(file_path, [self.current_range()] + self.extra_ranges, self.wrap_hue.get())
                 messagebox.showinfo("Success", "The mask has been saved.")
             except ValueError:
                 messagebox.showerror("Error", "No color selected yet.")
@@ -263,26 +1255,117 @@ class ColorCalibrationApp:
         file_path = filedialog.askopenfilename(defaultextension=".txt", filetypes=[("Text file", "*.txt")])
         if file_path:
             try:
-                with open(file_path, 'r') as f:
-                    lines = f.readlines()
-                    if len(lines) == 2:
-                        lower_str = lines[0].strip().split(',')
-                        upper_str = lines[1].strip().split(',')
-                        if len(lower_str) == 3 and len(upper_str) == 3:
-                            lower_hsv = [int(x) for x in lower_str]
-                            upper_hsv = [int(x) for x in upper_str]
-                            self.hsv_value.set(f"H: {lower_hsv[0]}, S: {lower_hsv[1]}, V: {lower_hsv[2]}")
-                            self.h_tolerance.set(upper_hsv[0])
-                            self.s_tolerance.set(upper_hsv[1])
-                            self.v_tolerance.set(upper_hsv[2])
-                            self.update_binary_mask()
-                            messagebox.showinfo("Success", "The mask has been loaded.")
-                        else:
-                            messagebox.showerror("Error", "Nieprawidłowy format wartości HSV.")
-                    else:
-                        messagebox.showerror("Error", "Invalid HSV value format.")
+                pairs, wrap_hue = read_mask_file(file_path)
+            except ValueError:
+                messagebox.showerror("Error", "Invalid HSV value format.")
+                return
             except Exception as e:
                 messagebox.showerror("Error", f"An error occurred while loading the mask: {e}")
+                return
+            self.apply_pairs(pairs, wrap_hue)
+            messagebox.showinfo("Success", "The mask has been loaded.")
+
+    def apply_pairs(self, pairs, wrap_hue):
+        # The first pair goes to the sliders, the rest become additional ranges
+        (center, tolerance), *extra_ranges = pairs
+        self.wrap_hue.set(wrap_hue)
+        self.hsv_value.set(f"H: {center[0]}, S: {center[1]}, V: {center[2]}")
+        self.h_tolerance.set(tolerance[0])
+        self.s_tolerance.set(tolerance[1])
+        self.v_tolerance.set(tolerance[2])
+        self.extra_ranges = [(tuple(c), tuple(t)) for c, t in extra_ranges]
+        self.refresh_ranges_list()
+        self.update_mask_from_sliders()
+
+    def choose_library(self):
+        file_path = filedialog.asksaveasfilename(title="Open or create mask library", defaultextension=".db",
+                                                 initialfile=os.path.basename(self.library_path),
+                                                 filetypes=[("Mask library", "*.db"), ("All files", "*.*")],
+                                                 confirmoverwrite=False)
+        if file_path:
+            self.library_path = file_path
+
+    def save_to_library(self):
+        try:
+            pairs = [self.current_range()] + self.extra_ranges
+        except ValueError:
+            messagebox.showerror("Error", "No color selected yet.")
+            return
+        name = simpledialog.askstring("Save to library", "Profile name:", initialvalue=self.profile_name, parent=self.master)
+        if not name:
+            return
+        try:
+            with MaskLibrary(self.library_path, create=True) as library:
+                version = library.save(name, pairs, wrap_hue=self.wrap_hue.get())
+        except (sqlite3.Error, ValueError) as e:
+            messagebox.showerror("Error", f"An error occurred while saving to the library: {e}")
+            return
+        self.profile_name = name
+        messagebox.showinfo("Success", f"Saved {name} as version {version}.")
+
+    def load_from_library(self):
+        if not os.path.exists(self.library_path):
+            messagebox.showinfo("Mask library", f"There is no mask library at {self.library_path} yet.")
+            return
+        try:
+            with MaskLibrary(self.library_path) as library:
+                profiles = library.names()
+        except (sqlite3.Error, ValueError) as e:
+            messagebox.showerror("Error", f"Cannot open the mask library: {e}")
+            return
+        if not profiles:
+            messagebox.showinfo("Mask library", "The library is empty.")
+            return
+
+        chooser = tk.Toplevel(self.master)
+        chooser.title(f"Mask library - {os.path.basename(self.library_path)}")
+        search = tk.StringVar(chooser)
+        tk.Entry(chooser, textvariable=search).pack(fill="x")
+        listbox = tk.Listbox(chooser, width=40, height=20)
+        listbox.pack(fill="both", expand=True)
+        shown = []
+
+        def refresh(*args):
+            text = search.get().lower()
+            shown[:] = [profile for profile in profiles if text in profile[0].lower()]
+            listbox.delete(0, tk.END)
+            for name, version, created in shown:
+                listbox.insert(tk.END, f"{name} (v{version}, {time.strftime('%Y-%m-%d %H:%M', time.localtime(created))})")
+
+        def load_selected(event=None):
+            selection = listbox.curselection()
+            if not selection:
+                return
+            name = shown[selection[0]][0]
+            try:
+                with MaskLibrary(self.library_path) as library:
+                    pairs, wrap_hue = library.load(name)
+            except (sqlite3.Error, KeyError, ValueError) as e:
+                messagebox.showerror("Error", f"An error occurred while loading {name}: {e}", parent=chooser)
+                return
+            self.profile_name = name
+            self.apply_pairs(pairs, wrap_hue)
+            chooser.destroy()
+
+        search.trace_add("write", refresh)
+        listbox.bind("<Double-Button-1>", load_selected)
+        tk.Button(chooser, text="Load", command=load_selected).pack(fill="x")
+        refresh()
+
+    def import_mask_files(self):
+        file_paths = filedialog.askopenfilenames(filetypes=[("Text file", "*.txt")])
+        if not file_paths:
+            return
+        try:
+            with MaskLibrary(self.library_path, create=True) as library:
+                imported, errors = library.import_files(file_paths)
+        except (sqlite3.Error, ValueError) as e:
+            messagebox.showerror("Error", f"An error occurred while importing: {e}")
+            return
+        message = f"Imported {imported} masks."
+        if errors:
+            message += f"\n{len(errors)} files could not be read:\n" + "\n".join(f"{path}: {e}" for path, e in errors[:10])
+        messagebox.showinfo("Import", message)
 
     def resize_image(self, img, target_width, target_height):
         if img is not None:
@@ -308,12 +1391,6 @@ class ColorCalibrationApp:
         return None
 
 
-    def convert_cv2_to_tkinter(self, img):
-        if img is not None:
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            img_pil = Image.fromarray(img)
-            return ImageTk.PhotoImage(image=img_pil)
-        return None
     def set_manual_hsv(self):
         try:
             h = int(self.h_manual.get())
@@ -328,61 +1405,165 @@ class ColorCalibrationApp:
             messagebox.showwarning("Error", "Enter valid integers for H, S, and V.")
 
 
+    def open_calibration_set(self):
+        file_paths = filedialog.askopenfilenames(filetypes=[("Images", "*.png *.jpg *.jpeg *.bmp *.tif *.tiff *.webp"),
+                                                            ("All files", "*.*")])
+        if not file_paths:
+            return
+
+        def add_cell(image):
+            index = len(cells)
+            cell = tk.Frame(grid, bd=0, padx=3, pady=3)
+            cell.grid(row=index // columns, column=index % columns, padx=2, pady=2)
+            original = tk.Canvas(cell, width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE, bg="black", highlightthickness=0)
+            original.grid(row=0, column=0)
+            # The view holds the only reference to its PhotoImage, so it is kept with the cell
+            original_view = CanvasImageView(original)
+            original_view.show(image.thumbnail)
+            mask = tk.Canvas(cell, width=THUMBNAIL_SIZE, height=THUMBNAIL_SIZE, bg="black", highlightthickness=0)
+            mask.grid(row=0, column=1)
+            text = tk.StringVar(cell, value=image.name)
+            tk.Label(cell, textvariable=text).grid(row=1, column=0, columnspan=2)
+            for widget in (original, mask):
+                # Clicking a thumbnail opens the image in the main window
+                widget.bind("<Button-1>", lambda event, path=image.path: open_in_main(path))
+            cells.append((cell, original_view, CanvasImageView(mask), text, cell.cget("bg")))
+
+        def open_in_main(path):
+            self.load_image(path)
+
+        def poll_loading():
+            added = False
+            for future in [future for future in pending if future.done()]:
+                pending.remove(future)
+                try:
+                    image = future.result()
+                except (ValueError, cv2.error) as e:
+                    failed.append(str(e))
+                    continue
+                calibration_set.images.append(image)
+                add_cell(image)
+                added = True
+            if pending:
+                summary.set(f"Loading {len(calibration_set.images)}/{len(file_paths)}...")
+                loading_job[0] = window.after(50, poll_loading)
+            else:
+                loading_job[0] = None
+                if failed:
+                    messagebox.showwarning("Calibration set", f"{len(failed)} images could not be loaded:\n" +
+                                           "\n".join(failed[:10]), parent=window)
+            if added:
+                self.update_calibration_set()
+
+        def render(params, quality):
+            # Runs on the render worker, the images themselves are thresholded on the set's thread pool
+            compiled_mask, postprocess, images = params
+            return images, calibration_set.evaluate(images, compiled_mask, postprocess, self.mask_cache, fast=quality == "fast")
+
+        def show_results(result, quality):
+            images, results = result
+            coverages = [coverage for coverage, _ in results]
+            flags = find_outliers(coverages)
+            for (cell, _, view, text, background), image, (coverage, thumbnail), flag in zip(cells, images, results, flags):
+                view.show(thumbnail)
+                text.set(f"{image.name}: {coverage:.2%}" + (f" ({flag})" if flag else ""))
+                cell.config(bg=OUTLIER_COLORS.get(flag, background))
+            under, over = flags.count("under"), flags.count("over")
+            summary.set(f"{len(images)} images, aggregate coverage {aggregate_coverage(images, coverages):.2%} "
+                        f"(min {min(coverages):.2%}, max {max(coverages):.2%})\n"
+                        f"{under} under-selected (blue), {over} over-selected (red)")
+
+        def update(compiled_mask, postprocess):
+            if calibration_set.images:
+                scheduler.submit((compiled_mask, postprocess, list(calibration_set.images)))
+
+        def on_destroy(event):
+            if event.widget is window:
+                if loading_job[0] is not None:
+                    window.after_cancel(loading_job[0])
+                scheduler.close()
+                calibration_set.close()
+                if self._calibration_set_update is update:
+                    self._calibration_set_update = None
+
+        window = tk.Toplevel(self.master)
+        window.title(f"Calibration set ({len(file_paths)} images)")
+        window.geometry("1000x700")
+        summary = tk.StringVar(window, value="Loading...")
+        tk.Label(window, textvariable=summary, justify=tk.LEFT, anchor="w").pack(fill="x", padx=5, pady=5)
+
+        # Scrollable grid of original/mask thumbnail pairs
+        scroll_canvas = tk.Canvas(window, highlightthickness=0)
+        scrollbar = tk.Scrollbar(window, orient=tk.VERTICAL, command=scroll_canvas.yview)
+        scroll_canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill="y")
+        scroll_canvas.pack(side=tk.LEFT, fill="both", expand=True)
+        grid = tk.Frame(scroll_canvas)
+        scroll_canvas.create_window(0, 0, anchor=tk.NW, window=grid)
+        grid.bind("<Configure>", lambda event: scroll_canvas.configure(scrollregion=scroll_canvas.bbox("all")))
+        columns = 4
+        cells = []
+
+        # Every image is decoded and reduced once, in parallel
+        calibration_set = CalibrationSet()
+        pending = calibration_set.load(file_paths)
+        failed = []
+        loading_job = [window.after(50, poll_loading)]
+        scheduler = MaskRenderScheduler(window, render, show_results, perf=self.perf, name="set")
+        self._calibration_set_update = update
+        window.bind("<Destroy>", on_destroy)
+        if self._calibration_set_window is not None and self._calibration_set_window.winfo_exists():
+            self._calibration_set_window.destroy()
+        self._calibration_set_window = window
+
     def open_binary_image_in_viewer(self, event=None):
         if self.original_image is None:
             return
 
-        def update_preview(*args):
-            h = int(h_slider.get())
-            s = int(s_slider.get())
-            v = int(v_slider.get())
-            h_tol = int(h_tol_slider.get())
-            s_tol = int(s_tol_slider.get())
-            v_tol = int(v_tol_slider.get())
-
-            lower = np.array([max(0, h - h_tol), max(0, s - s_tol), max(0, v - v_tol)])
-            upper = np.array([min(180, h + h_tol), min(255, s + s_tol), min(255, v + v_tol)])
+        def viewer_range():
+            return ((int(h_slider.get()), int(s_slider.get()), int(v_slider.get())),
+                    (int(h_tol_slider.get()), int(s_tol_slider.get()), int(v_tol_slider.get())))
 
-            hsv_img = cv2.cvtColor(self.original_image, cv2.COLOR_BGR2HSV)
-            mask = cv2.inRange(hsv_img, lower, upper)
-            mask_rgb = cv2.cvtColor(mask, cv2.COLOR_GRAY2RGB)
+        def update_preview(*args):
+            compiled_mask = self.compile_pairs([viewer_range()] + self.extra_ranges)
 
-            nonlocal current_mask_rgb
-            current_mask_rgb = mask_rgb
+            frame_width = mask_canvas.winfo_width()
+            frame_height = mask_canvas.winfo_height()
+            if frame_width < 10 or frame_height < 10:
+                return
 
-            resize_image_to_fit()
+            # Only the mask tiles in view are thresholded, on the render worker
+            img_height, img_width = self.original_image.shape[:2]
+            viewport.update(img_width, img_height, frame_width, frame_height)
+            cache_key = (self.image_generation, tuple(compiled_mask.ranges))
+            preview_scheduler.submit((self.hsv_pyramid, compiled_mask, self.build_postprocess(), cache_key, viewport.state()))
 
-        def resize_image_to_fit():
-            if current_mask_rgb is None:
-                return
+        def show_preview(frame, quality):
+            mask, x, y = frame
+            mask_view.show(mask, x, y)
 
-            frame_width = image_frame.winfo_width()
-            frame_height = image_frame.winfo_height()
-            if frame_width < 10 or frame_height < 10:
-                return
+        def on_resize(event):
+            update_preview()
 
-            img_height, img_width = current_mask_rgb.shape[:2]
-            aspect_ratio = img_width / img_height
+        def on_wheel(event):
+            viewport.zoom_at(1.25 if event.num == 4 or event.delta > 0 else 0.8, event.x, event.y)
+            update_preview()
 
-            # Calculate dimensions to fit the window without changing proportions
-            if frame_width / frame_height > aspect_ratio:
-                # Window is wider than image - adjust by height
-                new_height = frame_height
-                new_width = int(new_height * aspect_ratio)
-            else:
-                # The window is narrower or perfectly matched - adjust by width
-                new_width = frame_width
-                new_height = int(new_width / aspect_ratio)
+        def on_pan_start(event):
+            pan_anchor[:] = [event.x, event.y]
 
-            resized = cv2.resize(current_mask_rgb, (new_width, new_height), interpolation=cv2.INTER_AREA)
-            img_pil = Image.fromarray(resized)
-            mask_tk = ImageTk.PhotoImage(img_pil)
+        def on_pan_drag(event):
+            viewport.pan(event.x - pan_anchor[0], event.y - pan_anchor[1])
+            pan_anchor[:] = [event.x, event.y]
+            update_preview()
 
-            mask_label.configure(image=mask_tk)
-            mask_label.image = mask_tk
+        def fit_to_window(event=None):
+            viewport.fit_to_window()
+            update_preview()
 
-        def on_resize(event):
-            resize_image_to_fit()
+        def on_destroy(event):
+            if event.widget is viewer:
+                preview_scheduler.close()
 
         # === INTERFEJS ===
         viewer = tk.Toplevel(self.master)
@@ -428,20 +1609,7 @@ class ColorCalibrationApp:
             file_path = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text file", "*.txt")])
             if file_path:
                 try:
-                    h_val = h_slider.get()
-                    s_val = s_slider.get()
-                    v_val = v_slider.get()
-                    h_tol_val = h_tol_slider.get()
-                    s_tol_val = s_tol_slider.get()
-                    v_tol_val = v_tol_slider.get()
-
-                    lower_bound = [max(0, h_val), max(0, s_val), max(0, v_val)]
-                    upper_bound = [min(180, h_tol_val), min(255, s_tol_val), min(255, v_tol_val)]
-
-                    with open(file_path, 'w') as f:
-                        f.write(f"{lower_bound[0]},{lower_bound[1]},{lower_bound[2]}\n")
-                        f.write(f"{upper_bound[0]},{upper_bound[1]},{upper_bound[2]}\n")
-                    
+                    write_mask_file(file_path, [viewer_range()] + self.extra_ranges, self.wrap_hue.get())
                     messagebox.showinfo("Success", "The mask has been saved.")
                 except Exception as e:
                     messagebox.showerror("Error", f"There was a problem saving the mask: {e}")
@@ -450,26 +1618,29 @@ class ColorCalibrationApp:
             file_path = filedialog.askopenfilename(defaultextension=".txt", filetypes=[("Text file", "*.txt")])
             if file_path:
                 try:
-                    with open(file_path, 'r') as f:
-                        lines = f.readlines()
-                        if len(lines) == 2:
-                            lower = list(map(int, lines[0].strip().split(',')))
-                            upper = list(map(int, lines[1].strip().split(',')))
-
-                            h_slider.set(lower[0])
-                            s_slider.set(lower[1])
-                            v_slider.set(lower[2])
-
-                            h_tol_slider.set(upper[0])
-                            s_tol_slider.set(upper[1])
-                            v_tol_slider.set(upper[2])
-
-                            update_preview()
-                            messagebox.showinfo("Success", "The mask has been loaded.")
-                        else:
-                            messagebox.showerror("Error", "Invalid mask file format.")
+                    ((center, tolerance), *extra_ranges), wrap_hue = read_mask_file(file_path)
+                except ValueError:
+                    messagebox.showerror("Error", "Invalid mask file format.")
+                    return
                 except Exception as e:
                     messagebox.showerror("Error", f"There was a problem loading the mask: {e}")
+                    return
+
+                h_slider.set(center[0])
+                s_slider.set(center[1])
+                v_slider.set(center[2])
+
+                h_tol_slider.set(tolerance[0])
+                s_tol_slider.set(tolerance[1])
+                v_tol_slider.set(tolerance[2])
+
+                self.extra_ranges = [(tuple(c), tuple(t)) for c, t in extra_ranges]
+                self.wrap_hue.set(wrap_hue)
+                self.refresh_ranges_list()
+                update_preview()
+                # The additional ranges and hue wrapping are shared with the main window
+                self.update_binary_mask()
+                messagebox.showinfo("Success", "The mask has been loaded.")
         tk.Button(controls_frame, text="Save mask", command=save_mask_from_viewer).pack(fill="x")
         tk.Button(controls_frame, text="Load mask", command=load_mask_into_viewer).pack(fill="x")
 
@@ -477,24 +1648,46 @@ class ColorCalibrationApp:
             slider.bind("<B1-Motion>", update_preview)
             slider.bind("<ButtonRelease-1>", update_preview)
 
-        image_frame = tk.Frame(viewer, bg="black")
-        image_frame.grid(row=0, column=1, sticky="nsew")
-        image_frame.bind("<Configure>", on_resize)
-
-        mask_label = tk.Label(image_frame, bg="black")
-        mask_label.pack(expand=True)
-
-        current_mask_rgb = None
+        mask_canvas = tk.Canvas(viewer, bg="black", highlightthickness=0)
+        mask_canvas.grid(row=0, column=1, sticky="nsew")
+        mask_canvas.bind("<Configure>", on_resize)
+        mask_canvas.bind("<MouseWheel>", on_wheel)
+        mask_canvas.bind("<Button-4>", on_wheel)
+        mask_canvas.bind("<Button-5>", on_wheel)
+        mask_canvas.bind("<ButtonPress-1>", on_pan_start)
+        mask_canvas.bind("<B1-Motion>", on_pan_drag)
+        mask_canvas.bind("<Double-Button-1>", fit_to_window)
+        mask_view = CanvasImageView(mask_canvas)
+        viewport = Viewport()
+        pan_anchor = [0, 0]
+
+        preview_scheduler = MaskRenderScheduler(viewer, self.render_mask_viewport, show_preview, perf=self.perf, name="viewer")
+        viewer.bind("<Destroy>", on_destroy)
 
         update_preview()
 
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Interactive HSV color mask calibration.")
+    parser.add_argument("image", nargs="?", help="image to open at startup")
+    parser.add_argument("--mask", help="mask file to load at startup")
+    args = parser.parse_args()
+    mask = None
+    if args.mask:
+        try:
+            mask = read_mask_file(args.mask)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
     root = tk.Tk()
     try:
         root.state('zoomed')
     except:
         root.attributes('-zoomed', True)
     app = ColorCalibrationApp(root)
+    if mask:
+        app.apply_pairs(*mask)
+    if args.image:
+        app.load_image(args.image)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from tiled_image import build_pyramids
+
+THUMBNAIL_SIZE = 128
+# Coverage is measured on the largest pyramid level up to this many pixels
+ANALYSIS_PIXELS = 1 << 19
+
+
+class CalibrationImage:
+    # One reference image of a calibration set, reduced once at load time to an HSV analysis
+    # level for coverage, a thumbnail-sized HSV level for the fast pass and an RGB thumbnail
+    def __init__(self, path, image):
+        self.path = path
+        self.name = os.path.basename(path)
+        height, width = image.shape[:2]
+        self.width = width
+        self.pixels = height * width
+        image_pyramid, hsv_pyramid = build_pyramids(image, min_size=THUMBNAIL_SIZE)
+        self.analysis = next((level for level in hsv_pyramid if level.shape[0] * level.shape[1] <= ANALYSIS_PIXELS),
+                             hsv_pyramid[-1])
+        self.preview = hsv_pyramid[-1]
+        scale = min(THUMBNAIL_SIZE / width, THUMBNAIL_SIZE / height)
+        self.thumbnail_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        self.thumbnail = cv2.cvtColor(cv2.resize(image_pyramid[-1], self.thumbnail_size, interpolation=cv2.INTER_AREA),
+                                      cv2.COLOR_BGR2RGB)
+
+    @classmethod
+    def load(cls, path):
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError(f"cannot decode {path}")
+        return cls(path, image)
+
+    def evaluate(self, compiled_mask, postprocess, cache, fast=False):
+        # (coverage, mask thumbnail) for the current mask; thresholded levels are cached like previews
+        level = self.preview if fast else self.analysis
+        key = ("set", self.path, tuple(compiled_mask.ranges), level.shape)
+        mask = cache.get(key)
+        if mask is None:
+            mask = compiled_mask.apply(level)
+            cache.put(key, mask)
+        mask = postprocess.run(mask, key, cache, scale=level.shape[1] / self.width)
+        coverage = cv2.countNonZero(mask) / (mask.shape[0] * mask.shape[1])
+        return coverage, cv2.resize(mask, self.thumbnail_size, interpolation=cv2.INTER_AREA)
+
+
+class CalibrationSet:
+    # Reference images loaded and evaluated on a shared thread pool; OpenCV releases the GIL,
+    # so images are thresholded in parallel
+    def __init__(self, workers=None):
+        self.images = []
+        self.pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+
+    def load(self, paths):
+        # One future per path, resolving to a CalibrationImage
+        return [self.pool.submit(CalibrationImage.load, path) for path in paths]
+
+    def evaluate(self, images, compiled_mask, postprocess, cache, fast=False):
+        return list(self.pool.map(lambda image: image.evaluate(compiled_mask, postprocess, cache, fast), images))
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def aggregate_coverage(images, coverages):
+    # Coverage over all pixels of the set, so large images weigh more than thumbnails
+    pixels = np.array([image.pixels for image in images], dtype=np.float64)
+    return float(np.dot(pixels, coverages) / pixels.sum()) if len(images) else 0.0
+
+
+def find_outliers(coverages, threshold=3.0, min_spread=0.01):
+    # "under", "over" or None per image: coverage further than threshold robust deviations
+    # (scaled median absolute deviation, at least min_spread) from the median of the set
+    coverages = np.asarray(coverages, dtype=np.float64)
+    if len(coverages) < 3:
+        return [None] * len(coverages)
+    median = np.median(coverages)
+    spread = max(1.4826 * np.median(np.abs(coverages - median)), min_spread)
+    scores = (coverages - median) / spread
+    return ["under" if score < -threshold else "over" if score > threshold else None for score in scores]
@@ -0,0 +1,265 @@
+import argparse
+import json
+import signal
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+from hsv_mask import CompiledMask, apply_mask, range_from_center
+from video_source import FpsMeter
+
+DEFAULT_NAME = "calibration_frames"
+MAGIC = 0x43414C4946524D31  # "CALIFRM1"
+THRESHOLD_BYTES = 1 << 16
+
+# Header fields, one uint64 each
+_MAGIC, _WIDTH, _HEIGHT, _CHANNELS, _SLOTS, _LATEST, _THRESHOLD_SEQ, _THRESHOLD_LENGTH = range(8)
+_HEADER_FIELDS = 8
+
+
+def _layout(width, height, channels, slots):
+    # Header, per-slot sequence numbers, threshold payload, then the frame slots (64-byte aligned)
+    slot_offset = _HEADER_FIELDS * 8
+    threshold_offset = slot_offset + slots * 8
+    frame_offset = -(-(threshold_offset + THRESHOLD_BYTES) // 64) * 64
+    frame_bytes = -(-(width * height * channels) // 64) * 64
+    return slot_offset, threshold_offset, frame_offset, frame_bytes, frame_offset + slots * frame_bytes
+
+
+class SharedFrameBuffer:
+    # Ring of frame slots in a multiprocessing.shared_memory block, written by one publisher
+    # process and read in place by the calibration app. A slot's sequence number is cleared
+    # while it is being written, so a reader can tell when a frame it is still using has been
+    # overwritten. The block also carries the thresholds edited in the app, guarded by a
+    # sequence counter that is odd while they are being rewritten.
+    def __init__(self, name=DEFAULT_NAME, create=False, width=0, height=0, channels=3, slots=4):
+        if create:
+            size = _layout(width, height, channels, slots)[-1]
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self._shm = _attach(name)
+        self.name = name
+        self._header = np.ndarray((_HEADER_FIELDS,), dtype=np.uint64, buffer=self._shm.buf)
+        if create:
+            self._header[:] = 0
+            self._header[_WIDTH], self._header[_HEIGHT] = width, height
+            self._header[_CHANNELS], self._header[_SLOTS] = channels, slots
+            self._header[_MAGIC] = MAGIC
+        elif int(self._header[_MAGIC]) != MAGIC:
+            self.close()
+            raise ValueError(f"Shared memory block {name} does not hold calibration frames")
+
+        self.width, self.height = int(self._header[_WIDTH]), int(self._header[_HEIGHT])
+        self.channels, self.slots = int(self._header[_CHANNELS]), int(self._header[_SLOTS])
+        slot_offset, threshold_offset, frame_offset, frame_bytes, _ = _layout(self.width, self.height, self.channels, self.slots)
+        self._slot_seq = np.ndarray((self.slots,), dtype=np.uint64, buffer=self._shm.buf, offset=slot_offset)
+        self._thresholds = np.ndarray((THRESHOLD_BYTES,), dtype=np.uint8, buffer=self._shm.buf, offset=threshold_offset)
+        shape = (self.height, self.width, self.channels) if self.channels > 1 else (self.height, self.width)
+        self._frames = [np.ndarray(shape, dtype=np.uint8, buffer=self._shm.buf, offset=frame_offset + i * frame_bytes)
+                        for i in range(self.slots)]
+        self._last_threshold_seq = 0
+        self._last_payload = None
+
+    def publish(self, frame):
+        seq = int(self._header[_LATEST]) + 1
+        slot = seq % self.slots
+        self._slot_seq[slot] = 0
+        self._frames[slot][:] = frame
+        self._slot_seq[slot] = seq
+        self._header[_LATEST] = seq
+        return seq
+
+    def latest(self):
+        # (seq, frame) of the newest complete frame or None. The frame is a view into shared
+        # memory, not a copy: check is_current(seq) after using it.
+        seq = int(self._header[_LATEST])
+        if seq == 0 or int(self._slot_seq[seq % self.slots]) != seq:
+            return None
+        return seq, self._frames[seq % self.slots]
+
+    def is_current(self, seq):
+        return int(self._slot_seq[seq % self.slots]) == seq
+
+    def write_thresholds(self, pairs, wrap_hue=False):
+        # Mask file pairs and their hue mode plus the resulting lower/upper bounds, for consumers
+        # without hsv_mask (lower hue > upper hue wraps through 0/180)
+        ranges = [range_from_center(center, tolerance, wrap_hue) for center, tolerance in pairs]
+        payload = json.dumps({"pairs": [[list(c), list(t)] for c, t in pairs], "wrap_hue": bool(wrap_hue),
+                              "ranges": [[list(lower), list(upper)] for lower, upper in ranges]}).encode()
+        if payload == self._last_payload:
+            return False
+        if len(payload) > THRESHOLD_BYTES:
+            raise ValueError(f"Thresholds do not fit in {THRESHOLD_BYTES} bytes")
+        self._header[_THRESHOLD_SEQ] += np.uint64(1)
+        self._thresholds[:len(payload)] = np.frombuffer(payload, dtype=np.uint8)
+        self._header[_THRESHOLD_LENGTH] = len(payload)
+        self._header[_THRESHOLD_SEQ] += np.uint64(1)
+        self._last_payload = payload
+        return True
+
+    def read_thresholds(self):
+        # Newly written thresholds as {"pairs": ..., "wrap_hue": ..., "ranges": ...}, or None if unchanged
+        seq = int(self._header[_THRESHOLD_SEQ])
+        if seq % 2 or seq == self._last_threshold_seq:
+            return None
+        payload = self._thresholds[:int(self._header[_THRESHOLD_LENGTH])].tobytes()
+        if int(self._header[_THRESHOLD_SEQ]) != seq:
+            return None  # rewritten while reading, picked up on the next call
+        self._last_threshold_seq = seq
+        return json.loads(payload)
+
+    def close(self):
+        self._header = self._slot_seq = self._thresholds = None
+        self._frames = []
+        try:
+            self._shm.close()
+        except BufferError:
+            pass  # frames still referenced by the caller keep the mapping alive until released
+
+    def unlink(self):
+        self._shm.unlink()
+
+
+def _attach(name):
+    # Attaching must not register the block with this process's resource tracker, or it would
+    # be unlinked under the publisher when the app exits
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+class SharedFrameSource:
+    # Polls a SharedFrameBuffer on a background thread and keeps only the newest frame. Each
+    # frame is copied out of its slot once, and frames the publisher overwrote during the copy
+    # are dropped, so nothing handed to prepare(frame) or returned by get() refers to shared
+    # memory the publisher keeps rewriting.
+    def __init__(self, name=DEFAULT_NAME, prepare=None, poll_interval=0.002):
+        self.buffer = SharedFrameBuffer(name)
+        self.prepare = prepare
+        self.poll_interval = poll_interval
+        self.receive_fps = FpsMeter()
+        self.dropped = 0
+        self._item = None
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def get(self):
+        # Newest (seq, frame, prepared) tuple not returned yet, or None
+        with self._lock:
+            item, self._item = self._item, None
+            return item
+
+    def write_thresholds(self, pairs, wrap_hue=False):
+        return self.buffer.write_thresholds(pairs, wrap_hue)
+
+    def close(self):
+        # Returns at once; the polling thread closes the buffer when it exits, so the mapping is
+        # never released under a frame it is still copying
+        self._closed.set()
+
+    def _run(self):
+        try:
+            self._poll()
+        finally:
+            self.buffer.close()
+
+    def _poll(self):
+        last_seq = 0
+        while not self._closed.is_set():
+            latest = self.buffer.latest()
+            if latest is None or latest[0] == last_seq:
+                time.sleep(self.poll_interval)
+                continue
+            seq, frame = latest
+            if last_seq:
+                self.dropped += seq - last_seq - 1
+            last_seq = seq
+            frame = frame.copy()
+            if not self.buffer.is_current(seq):
+                self.dropped += 1  # overwritten while being copied
+                continue
+            prepared = self.prepare(frame) if self.prepare is not None else None
+            with self._lock:
+                if self._item is not None:
+                    self.dropped += 1
+                self._item = (seq, frame, prepared)
+            self.receive_fps.tick()
+
+
+def synthetic_frames(width, height):
+    # Colored discs moving over a hue gradient
+    hue = np.tile(np.linspace(0, 179, width, dtype=np.uint8), (height, 1))
+    background = cv2.cvtColor(cv2.merge([hue, np.full_like(hue, 80), np.full_like(hue, 160)]), cv2.COLOR_HSV2BGR)
+    colors = [(0, 0, 255), (0, 200, 0), (255, 80, 0), (0, 220, 255)]
+    t = 0
+    while True:
+        frame = background.copy()
+        for i, color in enumerate(colors):
+            x = int(width / 2 + width / 3 * np.cos(t / 40 + i * 1.6))
+            y = int(height / 2 + height / 3 * np.sin(t / 30 + i * 1.6))
+            cv2.circle(frame, (x, y), min(width, height) // 10, color, -1)
+        yield frame
+        t += 1
+
+
+def capture_frames(source, width, height):
+    capture = cv2.VideoCapture(int(source) if source.isdigit() else source)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video {source}")
+    while True:
+        ok, frame = capture.read()
+        if not ok:
+            capture.set(cv2.CAP_PROP_POS_FRAMES, 0)  # loop files
+            continue
+        if frame.shape[:2] != (height, width):
+            frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+        yield frame
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Stand-in publisher: shares frames with the calibration app and "
+                                                 "applies the thresholds it writes back.")
+    parser.add_argument("--name", default=DEFAULT_NAME, help="shared memory block name")
+    parser.add_argument("--source", help="video file or camera index (default: synthetic frames)")
+    parser.add_argument("--size", default="1280x720", help="frame size WIDTHxHEIGHT")
+    parser.add_argument("--fps", type=float, default=30.0)
+    args = parser.parse_args(argv)
+
+    width, height = (int(x) for x in args.size.lower().split("x"))
+    frames = capture_frames(args.source, width, height) if args.source else synthetic_frames(width, height)
+    buffer = SharedFrameBuffer(args.name, create=True, width=width, height=height)
+    print(f"publishing {width}x{height} frames as {args.name!r}, Ctrl+C to stop")
+
+    # Unlink the block on kill as well as on Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    mask = None
+    next_due = time.perf_counter()
+    try:
+        for frame in frames:
+            seq = buffer.publish(frame)
+            thresholds = buffer.read_thresholds()
+            if thresholds is not None:
+                mask = CompiledMask.from_pairs(thresholds["pairs"], thresholds["wrap_hue"])
+                print(f"frame {seq}: new thresholds {thresholds['ranges']}")
+            if mask is not None and seq % int(max(args.fps, 1)) == 0:
+                selected = apply_mask(mask, frame)
+                print(f"frame {seq}: coverage {cv2.countNonZero(selected) / (width * height):.2%}")
+            next_due += 1 / args.fps
+            time.sleep(max(0.0, next_due - time.perf_counter()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        buffer.close()
+        buffer.unlink()
+
+
+if __name__ == "__main__":
+    main()
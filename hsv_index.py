@@ -0,0 +1,178 @@
+import cv2
+import numpy as np
+
+# Value ranges of OpenCV's 8-bit HSV channels
+HSV_RANGES = (180, 256, 256)
+FULL_BINS = HSV_RANGES
+
+
+class HsvHistogramIndex:
+    # 3D HSV histogram stored as a summed-volume table: the number of pixels inside any
+    # lower/upper box is answered with 8 lookups, independent of the image size.
+    # Counts are exact with FULL_BINS; coarser bins trade precision at the box edges for memory.
+    def __init__(self, hsv_pixels, bins=FULL_BINS, chunk_size=1 << 22):
+        self.bins = tuple(bins)
+        pixels = np.asarray(hsv_pixels).reshape(-1, 3)
+        self.total = len(pixels)
+
+        h_bins, s_bins, v_bins = self.bins
+        histogram = np.zeros(h_bins * s_bins * v_bins, dtype=np.int64)
+        # Chunked so the flat bin indices never need a full-image int64 temporary
+        for start in range(0, self.total, chunk_size):
+            chunk = pixels[start:start + chunk_size]
+            h, s, v = (self._to_bin(chunk[:, c].astype(np.int64), c) for c in range(3))
+            histogram += np.bincount((h * s_bins + s) * v_bins + v, minlength=histogram.size)
+
+        dtype = np.int32 if self.total < 2 ** 31 else np.int64
+        self.table = np.zeros((h_bins + 1, s_bins + 1, v_bins + 1), dtype=dtype)
+        self.table[1:, 1:, 1:] = histogram.reshape(self.bins)
+        for axis in range(3):
+            np.cumsum(self.table, axis=axis, out=self.table)
+
+    @classmethod
+    def from_bgr(cls, image, bins=FULL_BINS):
+        return cls(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), bins)
+
+    def _to_bin(self, values, channel):
+        if self.bins[channel] == HSV_RANGES[channel]:
+            return values
+        return values * self.bins[channel] // HSV_RANGES[channel]
+
+    def count(self, lower, upper):
+        # Pixels with lower <= hsv <= upper on every channel; lower/upper may be (..., 3) arrays
+        lower = np.asarray(lower, dtype=np.int64)
+        upper = np.asarray(upper, dtype=np.int64)
+        lo = [self._to_bin(np.clip(lower[..., c], 0, HSV_RANGES[c] - 1), c) for c in range(3)]
+        hi = [self._to_bin(np.clip(upper[..., c], 0, HSV_RANGES[c] - 1), c) + 1 for c in range(3)]
+        empty = (lower[..., 0] > upper[..., 0]) | (lower[..., 1] > upper[..., 1]) | (lower[..., 2] > upper[..., 2])
+        result = np.where(empty, 0, self._count_bins(lo, hi))
+        return int(result) if result.ndim == 0 else result
+
+    def _count_bins(self, lo, hi):
+        # Pixels in the bin boxes lo <= bin < hi, per channel lists of bin index arrays
+        t = self.table
+        return (t[hi[0], hi[1], hi[2]].astype(np.int64)
+                - t[lo[0], hi[1], hi[2]] - t[hi[0], lo[1], hi[2]] - t[hi[0], hi[1], lo[2]]
+                + t[lo[0], lo[1], hi[2]] + t[lo[0], hi[1], lo[2]] + t[hi[0], lo[1], lo[2]]
+                - t[lo[0], lo[1], lo[2]])
+
+    def coverage(self, lower, upper):
+        return self.count(lower, upper) / self.total if self.total else 0.0
+
+    def count_union(self, boxes):
+        # Pixels inside any of the (lower, upper) boxes. The union is split into disjoint boxes in
+        # bin space, slab by slab along H and S with merged V intervals, so overlapping boxes cost
+        # O(n^3) lookups at most instead of an exponential inclusion-exclusion.
+        bin_boxes = []
+        for lower, upper in boxes:
+            lower, upper = np.asarray(lower, dtype=np.int64), np.asarray(upper, dtype=np.int64)
+            if np.all(lower <= upper):
+                lo = [int(self._to_bin(np.clip(lower[c], 0, HSV_RANGES[c] - 1), c)) for c in range(3)]
+                hi = [int(self._to_bin(np.clip(upper[c], 0, HSV_RANGES[c] - 1), c)) + 1 for c in range(3)]
+                bin_boxes.append((lo, hi))
+        lowers, uppers = [], []
+        _split_disjoint(bin_boxes, 0, [0, 0, 0], [0, 0, 0], lowers, uppers)
+        if not lowers:
+            return 0
+        lowers, uppers = np.array(lowers).T, np.array(uppers).T
+        return int(self._count_bins(lowers, uppers).sum())
+
+    def coverage_union(self, boxes):
+        return self.count_union(boxes) / self.total if self.total else 0.0
+
+
+def _split_disjoint(boxes, axis, lower, upper, lowers, uppers):
+    # Appends disjoint [lower, upper) bin boxes covering the union of boxes to lowers/uppers
+    if axis == 2:
+        intervals = sorted((lo[2], hi[2]) for lo, hi in boxes)
+        start, stop = intervals[0]
+        for lo, hi in intervals[1:] + [(None, None)]:
+            if lo is not None and lo <= stop:
+                stop = max(stop, hi)
+                continue
+            lowers.append((lower[0], lower[1], start))
+            uppers.append((upper[0], upper[1], stop))
+            start, stop = lo, hi
+        return
+    edges = sorted({lo[axis] for lo, _ in boxes} | {hi[axis] for _, hi in boxes})
+    for start, stop in zip(edges, edges[1:]):
+        active = [(lo, hi) for lo, hi in boxes if lo[axis] <= start and hi[axis] >= stop]
+        if active:
+            lower[axis], upper[axis] = start, stop
+            _split_disjoint(active, axis + 1, lower, upper, lowers, uppers)
+
+
+SUGGEST_QUANTILES = (0.0, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2)
+# Hue offsets the candidates are taken at: 90 moves the 0/180 seam to the middle, so samples of
+# red on both sides of it yield wrapped hue intervals
+SUGGEST_HUE_SHIFTS = (0, 90)
+
+
+def count_wrapped(index, lower, upper):
+    # index.count for (..., 3) bounds where lower hue > upper hue wraps through 0/180
+    lower = np.asarray(lower, dtype=np.int64)
+    upper = np.asarray(upper, dtype=np.int64)
+    wrapped = lower[..., 0] > upper[..., 0]
+    first_upper = upper.copy()
+    first_upper[..., 0] = np.where(wrapped, HSV_RANGES[0] - 1, upper[..., 0])
+    second_lower = lower.copy()
+    second_lower[..., 0] = 0
+    return index.count(lower, first_upper) + np.where(wrapped, index.count(second_lower, upper), 0)
+
+
+def suggest_bounds(include_pixels, exclude_pixels=None, image_index=None, exclude_weight=1.0, bins=(90, 128, 128),
+                   image_pixels=None):
+    # Searches lower/upper HSV bounds maximising the included fraction of include_pixels minus the
+    # weighted included fraction of the exclusions. Without explicit exclusions, every image
+    # pixel outside the include samples (from image_index) counts as an exclusion. image_pixels
+    # is the pixel count of the image the samples come from, when image_index was built from a
+    # reduced level; the samples are then scaled down to the index's pixel count.
+    # Candidate bounds are per-channel quantiles of the include samples, with hue also taken
+    # across the 0/180 seam; all combinations are scored at once with summed-volume lookups.
+    # The returned lower hue is greater than the upper hue when the best interval wraps.
+    include_pixels = np.asarray(include_pixels).reshape(-1, 3)
+    if not len(include_pixels):
+        raise ValueError("No include samples")
+    include_index = HsvHistogramIndex(include_pixels, bins)
+    exclude_index = None
+    if exclude_pixels is not None and len(exclude_pixels):
+        exclude_index = HsvHistogramIndex(exclude_pixels, bins)
+    elif image_index is None:
+        raise ValueError("Either exclusion samples or an image index are required")
+
+    lowers, uppers = [], []
+    for shift in SUGGEST_HUE_SHIFTS:
+        lower_candidates = []
+        upper_candidates = []
+        for c in range(3):
+            values = include_pixels[:, c].astype(np.int64)
+            if c == 0:
+                values = (values + shift) % HSV_RANGES[0]
+            lower_candidates.append(np.unique(np.quantile(values, SUGGEST_QUANTILES, method="lower")).astype(np.int64))
+            upper_candidates.append(np.unique(np.quantile(values, [1 - q for q in SUGGEST_QUANTILES], method="higher")).astype(np.int64))
+
+        grids = np.meshgrid(*lower_candidates, *upper_candidates, indexing="ij")
+        lower = np.stack(grids[:3], axis=-1).reshape(-1, 3)
+        upper = np.stack(grids[3:], axis=-1).reshape(-1, 3)
+        valid = np.all(lower <= upper, axis=1)
+        lower, upper = lower[valid], upper[valid]
+        lower[:, 0] = (lower[:, 0] - shift) % HSV_RANGES[0]
+        upper[:, 0] = (upper[:, 0] - shift) % HSV_RANGES[0]
+        lowers.append(lower)
+        uppers.append(upper)
+    lower, upper = np.concatenate(lowers), np.concatenate(uppers)
+
+    included = count_wrapped(include_index, lower, upper) / include_index.total
+    if exclude_index is not None:
+        excluded = count_wrapped(exclude_index, lower, upper) / exclude_index.total
+    else:
+        # The samples are removed from the image counts in the index's own bins and pixel scale
+        scale = image_index.total / image_pixels if image_pixels else 1.0
+        samples = HsvHistogramIndex(include_pixels, image_index.bins)
+        background = max(image_index.total - samples.total * scale, 1)
+        excluded = np.maximum(count_wrapped(image_index, lower, upper) - count_wrapped(samples, lower, upper) * scale,
+                              0) / background
+
+    score = included - exclude_weight * excluded
+    best = int(np.argmax(score))
+    return lower[best], upper[best], float(included[best]), float(excluded[best])
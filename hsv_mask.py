@@ -0,0 +1,142 @@
+# Mask file parsing and mask application shared by the GUI, batch_threshold and frame_share.
+# Importing this module is cheap: numpy and cv2 are only imported once a mask is compiled or
+# applied, so processes that only read or write mask files never load them.
+
+HUE_RANGE = 180
+MAX_RANGES = 32
+# First line of mask files whose hue ranges wrap through 0/180
+WRAP_HUE_HEADER = "# hsv-mask v2 wrap-hue"
+
+
+def range_from_center(center, tolerance, wrap_hue=False):
+    # (lower, upper) around a picked color. With wrap_hue, hue is circular: lower hue > upper hue
+    # means the range wraps through 0/180. Without it the hue range is clamped to 0-180, as in
+    # mask files written before wrapping existed. Saturation and value are clamped to 0-255.
+    h, s, v = (int(x) for x in center)
+    h_tol, s_tol, v_tol = (int(x) for x in tolerance)
+    if not wrap_hue:
+        h_lower, h_upper = max(0, h - h_tol), min(HUE_RANGE, h + h_tol)
+    elif 2 * h_tol + 1 >= HUE_RANGE:
+        h_lower, h_upper = 0, HUE_RANGE - 1
+    else:
+        h_lower, h_upper = (h - h_tol) % HUE_RANGE, (h + h_tol) % HUE_RANGE
+    lower = (h_lower, max(0, s - s_tol), max(0, v - v_tol))
+    upper = (h_upper, min(255, s + s_tol), min(255, v + v_tol))
+    return lower, upper
+
+
+def range_boxes(lower, upper):
+    # Splits a range into boxes with lower <= upper on every channel
+    if lower[0] <= upper[0]:
+        return [(tuple(lower), tuple(upper))]
+    return [((lower[0], lower[1], lower[2]), (HUE_RANGE - 1, upper[1], upper[2])),
+            ((0, lower[1], lower[2]), (upper[0], upper[1], upper[2]))]
+
+
+def read_mask_file(file_path):
+    # Mask files hold pairs of lines: the picked H,S,V and its H,S,V tolerances. The files written
+    # by older versions have exactly one pair and no header; their hue ranges are clamped. Files
+    # whose hue ranges wrap through 0/180 start with WRAP_HUE_HEADER. Returns (pairs, wrap_hue).
+    with open(file_path, 'r') as f:
+        lines = [line.strip() for line in f if line.strip()]
+    wrap_hue = bool(lines) and lines[0] == WRAP_HUE_HEADER
+    if lines and lines[0].startswith('#'):
+        if not wrap_hue:
+            raise ValueError(f"{file_path}: unknown mask file header {lines[0]!r}")
+        lines = lines[1:]
+    if not lines or len(lines) % 2:
+        raise ValueError(f"{file_path}: expected pairs of center/tolerance lines, got {len(lines)} lines")
+    pairs = []
+    for center_line, tolerance_line in zip(lines[::2], lines[1::2]):
+        center = [int(x) for x in center_line.split(',')]
+        tolerance = [int(x) for x in tolerance_line.split(',')]
+        if len(center) != 3 or len(tolerance) != 3:
+            raise ValueError(f"{file_path}: expected 3 comma separated values per line")
+        pairs.append((center, tolerance))
+    return pairs, wrap_hue
+
+
+def write_mask_file(file_path, pairs, wrap_hue=False):
+    with open(file_path, 'w') as f:
+        if wrap_hue:
+            f.write(WRAP_HUE_HEADER + "\n")
+        for center, tolerance in pairs:
+            f.write(f"{center[0]},{center[1]},{center[2]}\n")
+            f.write(f"{min(180, tolerance[0])},{min(255, tolerance[1])},{min(255, tolerance[2])}\n")
+
+
+def load_mask(file_path):
+    return CompiledMask.from_pairs(*read_mask_file(file_path))
+
+
+def apply_mask(mask, images, color="bgr"):
+    # Applies a CompiledMask (or a mask file path) to one HxWx3 image, an NxHxWx3 batch array or
+    # an iterable of images such as a frame generator. Returns an HxW mask, an NxHxW mask array
+    # or a generator of masks respectively. color is "bgr" or "hsv".
+    if isinstance(mask, str):
+        mask = load_mask(mask)
+    if color not in ("bgr", "hsv"):
+        raise ValueError(f"color must be 'bgr' or 'hsv', got {color!r}")
+    if hasattr(images, "ndim"):
+        if images.ndim == 4:
+            # The whole batch goes through OpenCV as one tall image
+            count, height, width = images.shape[:3]
+            stacked = images.reshape(count * height, width, images.shape[3])
+            return mask.apply(_to_hsv(stacked, color)).reshape(count, height, width)
+        return mask.apply(_to_hsv(images, color))
+    return (mask.apply(_to_hsv(image, color)) for image in images)
+
+
+def _to_hsv(image, color):
+    if color == "hsv":
+        return image
+    import cv2
+    return cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+
+class CompiledMask:
+    # Any number of HSV ranges (up to MAX_RANGES) compiled into one 256-entry LUT per channel.
+    # Bit i of a channel's LUT entry is set when that channel value lies in range i, so a pixel
+    # is selected when the AND of its three LUT entries is non-zero: one LUT pass regardless of
+    # the number of ranges.
+    def __init__(self, ranges):
+        import numpy as np
+
+        self.ranges = [(tuple(int(x) for x in lower), tuple(int(x) for x in upper)) for lower, upper in ranges]
+        if len(self.ranges) > MAX_RANGES:
+            raise ValueError(f"At most {MAX_RANGES} ranges can be compiled, got {len(self.ranges)}")
+        dtype = np.uint8 if len(self.ranges) <= 8 else np.uint16 if len(self.ranges) <= 16 else np.int32
+
+        values = np.arange(256)
+        lut = np.zeros((256, 3), dtype=np.int64)
+        for bit, (lower, upper) in enumerate(self.ranges):
+            for channel in range(3):
+                if channel == 0 and lower[0] > upper[0]:
+                    inside = (values >= lower[0]) | (values <= upper[0])
+                else:
+                    inside = (values >= lower[channel]) & (values <= upper[channel])
+                lut[inside, channel] |= 1 << bit
+        self.lut = lut.astype(dtype).reshape(1, 256, 3)
+        boxes = self.boxes()
+        # A single non-wrapping range is cheapest as a plain inRange
+        self._single_box = tuple(np.array(bound) for bound in boxes[0]) if len(boxes) == 1 else None
+
+    @classmethod
+    def from_pairs(cls, pairs, wrap_hue=False):
+        return cls([range_from_center(center, tolerance, wrap_hue) for center, tolerance in pairs])
+
+    def boxes(self):
+        return [box for lower, upper in self.ranges for box in range_boxes(lower, upper)]
+
+    def apply(self, hsv_image):
+        # Returns a 0/255 uint8 mask, like cv2.inRange
+        import cv2
+        import numpy as np
+
+        if not self.ranges:
+            return np.zeros(hsv_image.shape[:2], dtype=np.uint8)
+        if self._single_box is not None:
+            return cv2.inRange(hsv_image, *self._single_box)
+        bits = cv2.split(cv2.LUT(hsv_image, self.lut))
+        combined = cv2.bitwise_and(cv2.bitwise_and(bits[0], bits[1]), bits[2])
+        return cv2.compare(combined, 0, cv2.CMP_NE)
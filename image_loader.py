@@ -0,0 +1,94 @@
+import collections
+import threading
+
+import cv2
+from PIL import Image
+
+from tiled_image import load_backing_store
+
+REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def reduced_decode(file_path, target_width, target_height):
+    # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale (DCT scaling), several times faster than a
+    # full decode; the largest reduction that still covers the target size is used. Returns None
+    # for other formats, where a reduced decode costs as much as the full one.
+    try:
+        with Image.open(file_path) as image:
+            if image.format not in ("JPEG", "MPO"):
+                return None
+            width, height = image.size
+    except Image.DecompressionBombError:
+        # Beyond PIL's pixel limit, so far larger than any screen
+        if file_path.lower().endswith((".jpg", ".jpeg")):
+            return cv2.imread(file_path, cv2.IMREAD_REDUCED_COLOR_8)
+        return None
+    except (OSError, ValueError):
+        return None
+    for factor, flag in REDUCED_FLAGS:
+        if width // factor >= target_width or height // factor >= target_height:
+            return cv2.imread(file_path, flag)
+    return None
+
+
+class AsyncImageLoad:
+    # Loads an image on a background thread: a reduced preview first, then the full decode.
+    # prepare(image) runs on the thread too (pyramids, index), prepare_preview for the preview if
+    # given. Progress and results are polled from the Tk thread with events(); a load is
+    # abandoned with cancel().
+    def __init__(self, file_path, target_size, prepare=None, prepare_preview=None):
+        self.file_path = file_path
+        self.target_size = target_size
+        self.prepare = prepare
+        self.prepare_preview = prepare_preview or prepare
+        self.progress = 0
+        self.stage = "Reading header"
+        self._events = collections.deque()
+        self._cancelled = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def events(self):
+        # ("preview" | "full", image, prepared) or ("error", exception, None) tuples since the last call
+        events = []
+        while self._events:
+            events.append(self._events.popleft())
+        return events
+
+    @property
+    def finished(self):
+        return not self._thread.is_alive()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _step(self, progress, stage):
+        self.progress = progress
+        self.stage = stage
+        return not self._cancelled.is_set()
+
+    def _run(self):
+        try:
+            if not self._step(5, "Decoding preview"):
+                return
+            preview = reduced_decode(self.file_path, *self.target_size)
+            if preview is not None:
+                if not self._step(15, "Preparing preview"):
+                    return
+                prepared = self.prepare_preview(preview) if self.prepare_preview is not None else None
+                if self._cancelled.is_set():
+                    return
+                self._events.append(("preview", preview, prepared))
+
+            if not self._step(25, "Decoding full resolution"):
+                return
+            image = load_backing_store(self.file_path)
+            if image is None:
+                raise ValueError(f"Cannot decode {self.file_path}")
+            if not self._step(70, "Building pyramids"):
+                return
+            prepared = self.prepare(image) if self.prepare is not None else None
+            if self._step(100, "Done"):
+                self._events.append(("full", image, prepared))
+        except Exception as e:
+            self._events.append(("error", e, None))
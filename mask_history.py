@@ -0,0 +1,92 @@
+import numpy as np
+
+from tiled_image import LRUCache
+
+
+class PackedMaskCache:
+    # LRU cache of binary masks stored as packed bits (1/8 of a uint8 mask), bounded by the
+    # packed size. Values go in and come out as 0/255 uint8 masks, so it can stand in for an
+    # LRUCache of mask tiles.
+    def __init__(self, max_bytes):
+        self._cache = LRUCache(max_bytes)
+
+    def __len__(self):
+        return len(self._cache)
+
+    @property
+    def nbytes(self):
+        return self._cache.nbytes
+
+    @property
+    def hits(self):
+        return self._cache.hits
+
+    @property
+    def misses(self):
+        return self._cache.misses
+
+    def hit_rate(self):
+        return self._cache.hit_rate()
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        packed, shape = entry
+        count = shape[0] * shape[1]
+        return (np.unpackbits(packed, count=count) * np.uint8(255)).reshape(shape)
+
+    def put(self, key, mask):
+        self._cache.put(key, _PackedEntry(np.packbits(mask.ravel() > 0), mask.shape))
+
+    def clear(self):
+        self._cache.clear()
+
+
+class _PackedEntry(tuple):
+    # (packed bits, shape) pair that reports its size to LRUCache
+    def __new__(cls, packed, shape):
+        return super().__new__(cls, (packed, shape))
+
+    @property
+    def nbytes(self):
+        return self[0].nbytes
+
+
+class ParamHistory:
+    # Undo/redo history of mask parameter states. Pushing the current state again is a no-op,
+    # so restoring a state from history does not record it twice.
+    def __init__(self, max_length=200):
+        self.max_length = max_length
+        self._states = []
+        self._position = -1
+
+    @property
+    def current(self):
+        return self._states[self._position] if self._states else None
+
+    def push(self, state):
+        if state == self.current:
+            return False
+        del self._states[self._position + 1:]
+        self._states.append(state)
+        if len(self._states) > self.max_length:
+            del self._states[0]
+        self._position = len(self._states) - 1
+        return True
+
+    def can_undo(self):
+        return self._position > 0
+
+    def can_redo(self):
+        return self._position < len(self._states) - 1
+
+    def undo(self):
+        if self.can_undo():
+            self._position -= 1
+        return self.current
+
+    def redo(self):
+        if self.can_redo():
+            self._position += 1
+        return self.current
@@ -0,0 +1,133 @@
+import json
+import os
+import sqlite3
+import time
+from urllib.request import pathname2url
+
+from hsv_mask import CompiledMask, read_mask_file
+
+DEFAULT_LIBRARY = os.path.join(os.path.expanduser("~"), ".hsv_masks.db")
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    name TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    created REAL NOT NULL,
+    comment TEXT NOT NULL DEFAULT '',
+    ranges TEXT NOT NULL,
+    PRIMARY KEY (name, version)
+) WITHOUT ROWID
+"""
+
+
+class MaskLibrary:
+    # Named, versioned masks in one SQLite file. Saving a name again adds a version, older
+    # versions are kept. ranges holds {"wrap_hue": bool, "ranges": [{"center": [h, s, v],
+    # "tolerance": [h, s, v]}, ...]}; a bare list, as stored before hue wrapping was recorded,
+    # means clamped hue like a mask file without header. The (name, version) primary key doubles
+    # as the index for listing and latest-version lookups.
+    def __init__(self, path=DEFAULT_LIBRARY, create=False):
+        # Only create=True makes a new library file; otherwise a missing path raises
+        # sqlite3.OperationalError instead of leaving an empty database behind
+        self.path = path
+        if create:
+            self._db = sqlite3.connect(path)
+        else:
+            self._db = sqlite3.connect(f"file:{pathname2url(os.path.abspath(path))}?mode=rw", uri=True)
+        try:
+            version = self._db.execute("PRAGMA user_version").fetchone()[0]
+            if version > SCHEMA_VERSION:
+                raise ValueError(f"{path}: mask library schema {version} is newer than supported ({SCHEMA_VERSION})")
+            tables = {row[0] for row in self._db.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            # The schema is only written into a new, empty database, never into another application's file
+            if not tables and (create or version == 0):
+                with self._db:
+                    self._db.execute(_SCHEMA)
+                    self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            elif "profiles" not in tables:
+                raise ValueError(f"{path}: not a mask library")
+        except (sqlite3.Error, ValueError):
+            self._db.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def save(self, name, pairs, comment="", wrap_hue=False):
+        # Stores pairs as a new version of name and returns its version number
+        with self._db:
+            return self._insert(name, pairs, comment, wrap_hue)
+
+    def _insert(self, name, pairs, comment, wrap_hue):
+        ranges = json.dumps({"wrap_hue": bool(wrap_hue),
+                             "ranges": [{"center": [int(x) for x in center], "tolerance": [int(x) for x in tolerance]}
+                                        for center, tolerance in pairs]})
+        version = self._db.execute("SELECT COALESCE(MAX(version), 0) + 1 FROM profiles WHERE name = ?",
+                                   (name,)).fetchone()[0]
+        self._db.execute("INSERT INTO profiles (name, version, created, comment, ranges) VALUES (?, ?, ?, ?, ?)",
+                         (name, version, time.time(), comment, ranges))
+        return version
+
+    def names(self):
+        # (name, latest version, created) for every profile, sorted by name
+        return self._db.execute("SELECT name, MAX(version), MAX(created) FROM profiles GROUP BY name ORDER BY name").fetchall()
+
+    def versions(self, name):
+        # (version, created, comment) of every version of name, newest first
+        return self._db.execute("SELECT version, created, comment FROM profiles WHERE name = ? ORDER BY version DESC",
+                                (name,)).fetchall()
+
+    def load(self, name, version=None):
+        # ((center, tolerance) pairs, wrap_hue) of a version of name, the latest by default
+        if version is None:
+            row = self._db.execute("SELECT ranges FROM profiles WHERE name = ? ORDER BY version DESC LIMIT 1",
+                                   (name,)).fetchone()
+        else:
+            row = self._db.execute("SELECT ranges FROM profiles WHERE name = ? AND version = ?", (name, version)).fetchone()
+        if row is None:
+            raise KeyError(f"No mask profile {name!r}" + (f" version {version}" if version is not None else ""))
+        return _decode(row[0])
+
+    def import_files(self, paths, comment="imported"):
+        # Imports mask .txt files in one transaction, named after the file without extension.
+        # Returns the number imported and a list of (path, error) for files that could not be read.
+        imported = 0
+        errors = []
+        with self._db:
+            for path in paths:
+                try:
+                    pairs, wrap_hue = read_mask_file(path)
+                except (OSError, ValueError) as e:
+                    errors.append((path, e))
+                    continue
+                self._insert(os.path.splitext(os.path.basename(path))[0], pairs, comment, wrap_hue)
+                imported += 1
+        return imported, errors
+
+    def preload(self, names=None):
+        # Latest version of every profile (or of the given names) compiled in one query:
+        # {name: CompiledMask}
+        rows = self._db.execute("SELECT name, ranges FROM profiles AS p WHERE version = "
+                                "(SELECT MAX(version) FROM profiles WHERE name = p.name)").fetchall()
+        wanted = None if names is None else set(names)
+        return {name: CompiledMask.from_pairs(*_decode(ranges)) for name, ranges in rows
+                if wanted is None or name in wanted}
+
+
+def _decode(ranges):
+    ranges = json.loads(ranges)
+    if isinstance(ranges, list):
+        ranges = {"wrap_hue": False, "ranges": ranges}
+    return [(entry["center"], entry["tolerance"]) for entry in ranges["ranges"]], ranges["wrap_hue"]
+
+
+def preload(path=DEFAULT_LIBRARY, names=None):
+    with MaskLibrary(path) as library:
+        return library.preload(names)
@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+
+
+class OverlayCompositor:
+    # Composites masks onto an RGB view at display resolution with whole-array OpenCV operations.
+    # Outputs and intermediates are kept in buffers that are reused while the view size stays the
+    # same, so redrawing allocates nothing. Returned arrays are overwritten by the next call.
+    def __init__(self):
+        self._buffers = {}
+        self._solid_colors = {}
+
+    def _buffer(self, name, shape):
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape:
+            buffer = self._buffers[name] = np.empty(shape, dtype=np.uint8)
+            self._solid_colors.pop(name, None)
+        return buffer
+
+    def _solid(self, name, shape, color):
+        # Buffer filled with color, refilled only when the color or the size changes
+        buffer = self._buffer(name, shape)
+        if self._solid_colors.get(name) != color:
+            buffer[:] = color
+            self._solid_colors[name] = color
+        return buffer
+
+    def _tint(self, rgb, mask, color, alpha, out, name):
+        # Blends color into out where mask is set
+        tinted = self._buffer(name + "_tinted", rgb.shape)
+        cv2.addWeighted(rgb, 1.0 - alpha, self._solid(name + "_color", rgb.shape, color), alpha, 0, dst=tinted)
+        cv2.copyTo(tinted, mask, out)
+
+    def fill(self, rgb, mask, color, alpha):
+        out = self._buffer("out", rgb.shape)
+        np.copyto(out, rgb)
+        self._tint(rgb, mask, color, alpha, out, "fill")
+        return out
+
+    def edges(self, rgb, mask, color, thickness=2):
+        # Mask outline via a morphological gradient, drawn opaque
+        edges = self._buffer("edges", mask.shape)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (thickness + 1, thickness + 1))
+        cv2.morphologyEx(mask, cv2.MORPH_GRADIENT, kernel, dst=edges)
+        out = self._buffer("out", rgb.shape)
+        np.copyto(out, rgb)
+        cv2.copyTo(self._solid("edge_color", rgb.shape, color), edges, out)
+        return out
+
+    def diff(self, rgb, mask, reference, alpha, added_color=(0, 255, 0), removed_color=(255, 0, 255)):
+        # Pixels selected by mask but not by reference are tinted added_color, the reverse
+        # removed_color. Returns (out, added pixels, removed pixels).
+        inverse = self._buffer("inverse", mask.shape)
+        added = self._buffer("added", mask.shape)
+        removed = self._buffer("removed", mask.shape)
+        cv2.bitwise_and(mask, cv2.bitwise_not(reference, dst=inverse), dst=added)
+        cv2.bitwise_and(reference, cv2.bitwise_not(mask, dst=inverse), dst=removed)
+        out = self._buffer("out", rgb.shape)
+        np.copyto(out, rgb)
+        self._tint(rgb, added, added_color, alpha, out, "added")
+        self._tint(rgb, removed, removed_color, alpha, out, "removed")
+        return out, cv2.countNonZero(added), cv2.countNonZero(removed)
@@ -0,0 +1,96 @@
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+
+class PerfRecorder:
+    # Hot-path timings per named stage. Every stage keeps its last `window` durations for rolling
+    # percentiles; every timed call is also kept as a trace event (the newest trace_limit), so a
+    # session can be exported as a Chrome trace (chrome://tracing, Perfetto) or a JSON summary.
+    def __init__(self, window=500, trace_limit=200_000):
+        self.window = window
+        self.enabled = True
+        self._durations = {}
+        self._totals = collections.Counter()
+        self._counters = collections.Counter()
+        self._events = collections.deque(maxlen=trace_limit)
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started, time.perf_counter() - started)
+
+    def record(self, name, started, duration):
+        # duration in seconds of a stage that began at perf_counter() time started
+        with self._lock:
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = collections.deque(maxlen=self.window)
+            durations.append(duration)
+            self._totals[name] += 1
+            self._events.append((name, started, duration, threading.get_ident()))
+
+    def count(self, name, n=1):
+        # Event counters such as dropped frames or coalesced renders
+        if self.enabled:
+            with self._lock:
+                self._counters[name] += n
+
+    def percentiles(self, name, q=(50, 90, 99)):
+        # Rolling percentiles in ms, or None before the stage has run
+        with self._lock:
+            durations = list(self._durations.get(name, ()))
+        if not durations:
+            return None
+        return tuple(np.percentile(durations, q) * 1000)
+
+    def summary(self):
+        with self._lock:
+            names = list(self._durations)
+            totals = dict(self._totals)
+            counters = dict(self._counters)
+        stages = {}
+        for name in names:
+            p50, p90, p99 = self.percentiles(name)
+            stages[name] = {"count": totals[name], "p50_ms": p50, "p90_ms": p90, "p99_ms": p99}
+        return {"stages": stages, "counters": counters}
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+            self._totals.clear()
+            self._counters.clear()
+            self._events.clear()
+
+    def export_chrome_trace(self, file_path):
+        # Complete ("X") events in the Trace Event Format, timestamps in microseconds
+        with self._lock:
+            events = list(self._events)
+            counters = dict(self._counters)
+        pid = os.getpid()
+        trace = [{"name": name, "ph": "X", "ts": (started - self._origin) * 1e6, "dur": duration * 1e6,
+                  "pid": pid, "tid": tid} for name, started, duration, tid in events]
+        end = (time.perf_counter() - self._origin) * 1e6
+        trace += [{"name": name, "ph": "C", "ts": end, "pid": pid, "args": {name: value}} for name, value in counters.items()]
+        with open(file_path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+    def export_json(self, file_path):
+        with self._lock:
+            events = [{"stage": name, "start_ms": (started - self._origin) * 1000, "duration_ms": duration * 1000,
+                       "thread": tid} for name, started, duration, tid in self._events]
+        with open(file_path, "w") as f:
+            json.dump(dict(self.summary(), events=events), f, indent=1)
@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+
+
+def _scaled_odd(size, scale):
+    # Kernel sizes are given in full-resolution pixels and scaled to the level being processed
+    scaled = int(round(size * scale))
+    return scaled | 1 if scaled > 1 else 1
+
+
+class MedianBlur:
+    def __init__(self, ksize):
+        self.ksize = ksize
+
+    def key(self):
+        return ("median", self.ksize)
+
+    def apply(self, mask, scale):
+        ksize = _scaled_odd(self.ksize, scale)
+        return cv2.medianBlur(mask, ksize) if ksize > 1 else mask
+
+
+class Morphology:
+    OPERATIONS = {"open": cv2.MORPH_OPEN, "close": cv2.MORPH_CLOSE}
+
+    def __init__(self, operation, ksize):
+        self.operation = operation
+        self.ksize = ksize
+
+    def key(self):
+        return (self.operation, self.ksize)
+
+    def apply(self, mask, scale):
+        ksize = _scaled_odd(self.ksize, scale)
+        if ksize <= 1:
+            return mask
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (ksize, ksize))
+        return cv2.morphologyEx(mask, self.OPERATIONS[self.operation], kernel)
+
+
+class MinAreaFilter:
+    # Drops connected regions smaller than min_area full-resolution pixels
+    def __init__(self, min_area):
+        self.min_area = min_area
+
+    def key(self):
+        return ("min_area", self.min_area)
+
+    def apply(self, mask, scale):
+        min_area = self.min_area * scale * scale
+        if min_area <= 1:
+            return mask
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+        keep = np.where(stats[:, cv2.CC_STAT_AREA] >= min_area, 255, 0).astype(np.uint8)
+        keep[0] = 0  # background label
+        return keep[labels]
+
+
+class PostProcessPipeline:
+    # Stages applied in order to a thresholded mask. Every stage output is cached under a key
+    # chained from the input mask key and all stage keys up to it, so changing a stage only
+    # recomputes that stage and the ones after it.
+    def __init__(self, stages):
+        self.stages = list(stages)
+
+    def key(self):
+        return tuple(stage.key() for stage in self.stages)
+
+    def run(self, mask, mask_key, cache, scale=1.0):
+        keys = []
+        key = mask_key
+        for stage in self.stages:
+            key = (key, stage.key())
+            keys.append(key)
+
+        # Resume after the deepest stage that is still cached
+        start = 0
+        for index in range(len(keys) - 1, -1, -1):
+            cached = cache.get(keys[index])
+            if cached is not None:
+                mask = cached
+                start = index + 1
+                break
+
+        for index in range(start, len(self.stages)):
+            mask = self.stages[index].apply(mask, scale)
+            cache.put(keys[index], mask)
+        return mask
@@ -0,0 +1,321 @@
+import collections
+import math
+import tempfile
+import threading
+
+import cv2
+import numpy as np
+from PIL import BmpImagePlugin, PpmImagePlugin, TiffImagePlugin
+
+TILE_SIZE = 512
+# Levels larger than this are kept in anonymous memory-mapped files instead of RAM
+MEMMAP_PIXELS = 100_000_000
+STRIP_ROWS = 1024
+# Formats whose pixel data may be stored uncompressed, read region by region by _read_raw
+RAW_IMAGE_CLASSES = (TiffImagePlugin.TiffImageFile, BmpImagePlugin.BmpImageFile, PpmImagePlugin.PpmImageFile)
+
+
+class LRUCache:
+    # Least-recently-used cache bounded by the total nbytes of its numpy values
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key).nbytes
+            self._items[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def allocate_level(shape, memmap_pixels=MEMMAP_PIXELS):
+    if shape[0] * shape[1] < memmap_pixels:
+        return np.empty(shape, dtype=np.uint8)
+    # Backed by an unnamed temporary file, pages are only read back for the tiles in view
+    return np.memmap(tempfile.TemporaryFile(prefix="calibration-"), dtype=np.uint8, mode="w+", shape=shape)
+
+
+def load_backing_store(file_path, memmap_pixels=MEMMAP_PIXELS):
+    # .npy arrays are memory-mapped directly without decoding. Uncompressed RGB files (raw TIFF
+    # strips or tiles, BMP, PPM) that are too large to comfortably keep in RAM are copied into a
+    # memory-mapped file region by region, so they are never held in memory as a whole. Other
+    # images are decoded whole by OpenCV and then spilled: compressed formats have no region
+    # decoder here, so their peak memory is still the full decode plus the copy.
+    if file_path.lower().endswith(".npy"):
+        return np.load(file_path, mmap_mode="r")
+    layout = _raw_layout(file_path)
+    if layout is not None and layout[0][0] * layout[0][1] >= memmap_pixels:
+        return _read_raw(file_path, *layout, memmap_pixels)
+    image = cv2.imread(file_path)
+    if image is None or image.shape[0] * image.shape[1] < memmap_pixels:
+        return image
+    store = allocate_level(image.shape, memmap_pixels)
+    store[:] = image
+    return store
+
+
+def _raw_layout(file_path):
+    # ((width, height), [(box, offset, rawmode, stride, orientation), ...]) when every tile of
+    # the file is stored uncompressed as 8-bit RGB or BGR, otherwise None
+    image = _open_header(file_path)
+    if image is None:
+        return None
+    try:
+        with image:
+            if image.mode != "RGB" or image.getexif().get(0x0112, 1) != 1:
+                return None  # rotated images are left to OpenCV, which applies the orientation
+            tiles = []
+            for tile in image.tile:
+                args = tile.args if isinstance(tile.args, tuple) else (tile.args,)
+                rawmode, stride, orientation = (args + (0, 1))[:3]
+                if tile.codec_name != "raw" or rawmode not in ("RGB", "BGR") or orientation not in (1, -1):
+                    return None
+                x0, y0, x1, y1 = tile.extents
+                tiles.append(((x0, y0, x1, y1), tile.offset, rawmode, stride or (x1 - x0) * 3, orientation))
+            return (image.size, tiles) if tiles else None
+    except (OSError, ValueError, SyntaxError):
+        return None
+
+
+def _open_header(file_path):
+    # Parses only the header with the format plugin directly. Image.open would apply PIL's
+    # decompression bomb limit, which large panoramas exceed; nothing is decoded here, and the
+    # process-wide limit stays untouched for other threads.
+    for image_class in RAW_IMAGE_CLASSES:
+        try:
+            return image_class(file_path)
+        except (OSError, ValueError, SyntaxError):
+            continue
+    return None
+
+
+def _read_raw(file_path, size, tiles, memmap_pixels):
+    width, height = size
+    data = np.memmap(file_path, dtype=np.uint8, mode="r")
+    store = allocate_level((height, width, 3), memmap_pixels)
+    for (x0, y0, x1, y1), offset, rawmode, stride, orientation in tiles:
+        tile = data[offset:offset + (y1 - y0) * stride].reshape(y1 - y0, stride)[:, :(x1 - x0) * 3]
+        tile = tile.reshape(y1 - y0, x1 - x0, 3)
+        if orientation == -1:
+            tile = tile[::-1]  # bottom-up rows
+        for y in range(0, y1 - y0, STRIP_ROWS):
+            strip = np.ascontiguousarray(tile[y:y + STRIP_ROWS])
+            if rawmode == "RGB":
+                strip = cv2.cvtColor(strip, cv2.COLOR_RGB2BGR)
+            store[y0 + y:y0 + y + len(strip), x0:x1] = strip
+    return store
+
+
+def _convert_to_hsv(image, memmap_pixels):
+    if image.shape[0] * image.shape[1] < memmap_pixels:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    hsv_image = allocate_level(image.shape, memmap_pixels)
+    for y in range(0, image.shape[0], STRIP_ROWS):
+        hsv_image[y:y + STRIP_ROWS] = cv2.cvtColor(np.ascontiguousarray(image[y:y + STRIP_ROWS]), cv2.COLOR_BGR2HSV)
+    return hsv_image
+
+
+def _halve(image, memmap_pixels):
+    # Exact 2x2 averaging (odd edges are dropped), computed in strips so memory-mapped levels
+    # are never loaded as a whole
+    height, width = image.shape[:2]
+    new_height, new_width = max(1, height // 2), max(1, width // 2)
+    source = image[:2 * new_height, :2 * new_width]
+    if height * width < memmap_pixels:
+        return cv2.resize(source, (new_width, new_height), interpolation=cv2.INTER_AREA)
+    level = allocate_level((new_height, new_width) + image.shape[2:], memmap_pixels)
+    for y in range(0, new_height, STRIP_ROWS):
+        rows = min(STRIP_ROWS, new_height - y)
+        strip = np.ascontiguousarray(source[2 * y:2 * (y + rows)])
+        level[y:y + rows] = cv2.resize(strip, (new_width, rows), interpolation=cv2.INTER_AREA)
+    return level
+
+
+def build_pyramids(image, min_size=256, memmap_pixels=MEMMAP_PIXELS):
+    # Returns BGR and HSV pyramids; level 0 is the full-resolution image
+    image_pyramid = [image]
+    hsv_pyramid = [_convert_to_hsv(image, memmap_pixels)]
+    level = image
+    while max(level.shape[:2]) > min_size:
+        level = _halve(level, memmap_pixels)
+        image_pyramid.append(level)
+        # Convert the downscaled BGR level rather than averaging hue values across the 0/180 seam
+        hsv_pyramid.append(_convert_to_hsv(level, memmap_pixels))
+    return image_pyramid, hsv_pyramid
+
+
+class Viewport:
+    # Zoom and pan state of one view. zoom is display pixels per full-resolution pixel and the
+    # origin is the canvas top-left corner in the zoomed image plane.
+    MAX_ZOOM = 32.0
+
+    def __init__(self):
+        self.fit = True
+        self.zoom = 1.0
+        self.origin_x = 0
+        self.origin_y = 0
+        self.image_size = (1, 1)
+        self.canvas_size = (1, 1)
+
+    def update(self, image_width, image_height, canvas_width, canvas_height):
+        self.image_size = (image_width, image_height)
+        self.canvas_size = (canvas_width, canvas_height)
+        if self.fit:
+            self.zoom = self.fit_zoom()
+        self._clamp()
+
+    def fit_zoom(self):
+        return min(self.canvas_size[0] / self.image_size[0], self.canvas_size[1] / self.image_size[1])
+
+    def fit_to_window(self):
+        self.fit = True
+        self.update(*self.image_size, *self.canvas_size)
+
+    def zoom_at(self, factor, x, y):
+        image_x, image_y = self.to_image(x, y)
+        self.zoom = min(max(self.zoom * factor, self.fit_zoom()), max(self.MAX_ZOOM, self.fit_zoom()))
+        self.fit = self.zoom == self.fit_zoom()
+        self.origin_x = round(image_x * self.zoom - x)
+        self.origin_y = round(image_y * self.zoom - y)
+        self._clamp()
+
+    def pan(self, dx, dy):
+        self.origin_x -= dx
+        self.origin_y -= dy
+        self._clamp()
+
+    def to_image(self, x, y):
+        return (x + self.origin_x) / self.zoom, (y + self.origin_y) / self.zoom
+
+    def to_canvas(self, image_x, image_y):
+        return image_x * self.zoom - self.origin_x, image_y * self.zoom - self.origin_y
+
+    def state(self):
+        return (self.zoom, self.origin_x, self.origin_y) + self.canvas_size
+
+    def visible_rect(self):
+        return visible_rect(self.state(), *self.image_size)
+
+    def _clamp(self):
+        # Center the image along an axis where it is smaller than the canvas, otherwise keep it covering the canvas
+        plane_width = self.image_size[0] * self.zoom
+        plane_height = self.image_size[1] * self.zoom
+        if plane_width <= self.canvas_size[0]:
+            self.origin_x = -round((self.canvas_size[0] - plane_width) / 2)
+        else:
+            self.origin_x = min(max(self.origin_x, 0), math.ceil(plane_width - self.canvas_size[0]))
+        if plane_height <= self.canvas_size[1]:
+            self.origin_y = -round((self.canvas_size[1] - plane_height) / 2)
+        else:
+            self.origin_y = min(max(self.origin_y, 0), math.ceil(plane_height - self.canvas_size[1]))
+
+
+def visible_rect(state, image_width, image_height):
+    # Canvas rectangle (x0, y0, x1, y1) covered by the image for a viewport state
+    zoom, origin_x, origin_y, canvas_width, canvas_height = state
+    return (max(0, -origin_x), max(0, -origin_y),
+            min(canvas_width, math.floor(image_width * zoom) - origin_x),
+            min(canvas_height, math.floor(image_height * zoom) - origin_y))
+
+
+def viewport_level(pyramid, zoom, level_offset=0):
+    # Coarsest pyramid level that still has at least one pixel per display pixel
+    full_width = pyramid[0].shape[1]
+    index = 0
+    for i, level in enumerate(pyramid):
+        if level.shape[1] / full_width >= zoom:
+            index = i
+    return min(index + level_offset, len(pyramid) - 1)
+
+
+def render_viewport(pyramid, state, tile_fn, cache, cache_key, level_offset=0, out=None, source_cache=None, binary=False):
+    # Renders the visible part of the image into a canvas-sized buffer. Only tiles that intersect
+    # the viewport are read from the pyramid, passed through tile_fn and resized; rendered tiles
+    # are cached by (cache_key, level, zoom, tile), so panning only renders newly exposed tiles.
+    # With a source_cache, tile_fn results are also cached before resizing, independent of the
+    # zoom, so views of the same level at different sizes share them. binary re-thresholds resized
+    # mask tiles, so they match what a packed mask cache returns on a hit.
+    zoom, origin_x, origin_y, canvas_width, canvas_height = state
+    index = viewport_level(pyramid, zoom, level_offset)
+    level = pyramid[index]
+    full_height, full_width = pyramid[0].shape[:2]
+    level_height, level_width = level.shape[:2]
+    scale_x = zoom * full_width / level_width
+    scale_y = zoom * full_height / level_height
+
+    # Keep rendered tiles around TILE_SIZE display pixels when zoomed in
+    tile_size = max(8, int(TILE_SIZE / max(scale_x, 1.0)))
+    interpolation = cv2.INTER_AREA if scale_x <= 1.0 else cv2.INTER_NEAREST
+
+    first = None
+    x_start = max(0, int(origin_x / scale_x)) // tile_size
+    x_stop = min(level_width, math.ceil((origin_x + canvas_width) / scale_x))
+    y_start = max(0, int(origin_y / scale_y)) // tile_size
+    y_stop = min(level_height, math.ceil((origin_y + canvas_height) / scale_y))
+    for tile_y in range(y_start, math.ceil(y_stop / tile_size)):
+        for tile_x in range(x_start, math.ceil(x_stop / tile_size)):
+            x0, y0 = tile_x * tile_size, tile_y * tile_size
+            x1, y1 = min(x0 + tile_size, level_width), min(y0 + tile_size, level_height)
+            # Tile edges are snapped in the zoomed plane, so neighbouring tiles always abut
+            dx0, dx1 = math.floor(x0 * scale_x), math.floor(x1 * scale_x)
+            dy0, dy1 = math.floor(y0 * scale_y), math.floor(y1 * scale_y)
+            if dx1 <= dx0 or dy1 <= dy0:
+                continue
+
+            key = (cache_key, index, zoom, tile_size, tile_x, tile_y)
+            tile = cache.get(key)
+            if tile is None:
+                source_key = (cache_key, index, tile_size, tile_x, tile_y)
+                source = source_cache.get(source_key) if source_cache is not None else None
+                if source is None:
+                    source = tile_fn(np.ascontiguousarray(level[y0:y1, x0:x1]))
+                    if source_cache is not None:
+                        source_cache.put(source_key, source)
+                tile = cv2.resize(source, (dx1 - dx0, dy1 - dy0), interpolation=interpolation)
+                if binary:
+                    cv2.threshold(tile, 127, 255, cv2.THRESH_BINARY, dst=tile)
+                cache.put(key, tile)
+
+            if first is None:
+                first = tile
+                shape = (canvas_height, canvas_width) + tile.shape[2:]
+                if out is None or out.shape != shape:
+                    out = np.empty(shape, dtype=np.uint8)
+                out[:] = 0
+
+            cx0, cy0 = max(dx0 - origin_x, 0), max(dy0 - origin_y, 0)
+            cx1, cy1 = min(dx1 - origin_x, canvas_width), min(dy1 - origin_y, canvas_height)
+            if cx1 > cx0 and cy1 > cy0:
+                out[cy0:cy1, cx0:cx1] = tile[cy0 + origin_y - dy0:cy1 + origin_y - dy0,
+                                             cx0 + origin_x - dx0:cx1 + origin_x - dx0]
+    return out, index
@@ -0,0 +1,112 @@
+import collections
+import threading
+import time
+
+import cv2
+
+
+class FpsMeter:
+    # Rate of tick() calls over a sliding time window
+    def __init__(self, window=1.0):
+        self.window = window
+        self._ticks = collections.deque()
+        self._lock = threading.Lock()
+
+    def tick(self):
+        now = time.perf_counter()
+        with self._lock:
+            self._ticks.append(now)
+            self._trim(now)
+
+    def rate(self):
+        now = time.perf_counter()
+        with self._lock:
+            self._trim(now)
+            if len(self._ticks) < 2:
+                return 0.0
+            return (len(self._ticks) - 1) / max(now - self._ticks[0], 1e-6)
+
+    def _trim(self, now):
+        while self._ticks and now - self._ticks[0] > self.window:
+            self._ticks.popleft()
+
+
+class VideoFrameSource:
+    # Decodes a video on a background thread into a bounded ring buffer. prepare(frame) runs on
+    # the decode thread too, so per-frame work such as HSV conversion never blocks the UI.
+    def __init__(self, file_path, buffer_size=8, prepare=None):
+        self.capture = cv2.VideoCapture(file_path)
+        if not self.capture.isOpened():
+            raise ValueError(f"Cannot open video {file_path}")
+        self.frame_count = int(self.capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 25.0
+        self.buffer_size = buffer_size
+        self.prepare = prepare
+        self.decode_fps = FpsMeter()
+        self.finished = False
+
+        self._buffer = collections.deque()
+        self._condition = threading.Condition()
+        self._seek_to = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def get(self):
+        # Next decoded (index, frame, prepared) tuple, or None if nothing is buffered yet
+        with self._condition:
+            if not self._buffer:
+                return None
+            item = self._buffer.popleft()
+            self._condition.notify_all()
+            return item
+
+    def seek(self, index):
+        with self._condition:
+            self._seek_to = max(0, min(index, max(self.frame_count - 1, 0)))
+            self._buffer.clear()
+            self.finished = False
+            self._condition.notify_all()
+
+    def close(self):
+        # Returns at once; the decode thread releases the capture when it exits, so it is never
+        # released while read() or prepare() is still running
+        with self._condition:
+            self._closed = True
+            self._buffer.clear()
+            self._condition.notify_all()
+
+    def _run(self):
+        try:
+            self._decode()
+        finally:
+            self.capture.release()
+
+    def _decode(self):
+        index = 0
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._closed or self._seek_to is not None
+                                         or (len(self._buffer) < self.buffer_size and not self.finished))
+                if self._closed:
+                    return
+                if self._seek_to is not None:
+                    index = self._seek_to
+                    self._seek_to = None
+                    self.capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+
+            ok, frame = self.capture.read()
+            prepared = self.prepare(frame) if ok and self.prepare is not None else None
+
+            with self._condition:
+                if self._closed:
+                    return
+                if self._seek_to is not None:
+                    continue  # a seek arrived while decoding, this frame is stale
+                if not ok:
+                    self.finished = True
+                    continue
+                self._buffer.append((index, frame, prepared))
+                self._condition.notify_all()
+            self.decode_fps.tick()
+            index += 1